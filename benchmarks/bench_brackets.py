@@ -0,0 +1,82 @@
+"""
+Serial vs parallel encoding of HDR bracket sets with the built-in encoders
+
+Runs without GIMP, the pixels are synthetic with photo-like entropy.
+Checks that the parallel output is byte-identical to the serial one.
+
+Usage, from the repository root:
+    python3 benchmarks/bench_brackets.py [--brackets 3 5 9] [--sizes 12 24 40] [--bits 8]
+"""
+
+from pathlib import Path
+from typing import List
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from nikimage import PixelData, write_images
+
+# Distinct rows cycled over the image, more than zlib's window apart
+PATTERN_ROWS = 64
+
+
+def make_pixels(megapixels: int, bits: int) -> PixelData:
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    row_size = width * 3 * bits // 8
+    rows = [bytes(b & 0x3F for b in os.urandom(row_size)) for _ in range(PATTERN_ROWS)]
+    data = b"".join(rows[y % PATTERN_ROWS] for y in range(height))
+    return PixelData(width, height, 3, bits, data)
+
+
+def digests(paths: List[str]) -> List[str]:
+    result = []
+    for path in paths:
+        with open(path, "rb") as file:
+            result.append(hashlib.blake2b(file.read(), digest_size=16).hexdigest())
+    return result
+
+
+def encode(brackets: List[PixelData], fmt: str, folder: str, workers: int):
+    paths = [os.path.join(folder, f"{workers}_{i}.{fmt}") for i in range(len(brackets))]
+    start = time.perf_counter()
+    write_images(list(zip(paths, brackets)), fmt, png_level=1, workers=workers)
+    elapsed = time.perf_counter() - start
+    return elapsed, digests(paths)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serial vs parallel bracket export")
+    parser.add_argument("--brackets", type=int, nargs="+", default=[3, 5, 9])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12, 24, 40])
+    parser.add_argument("--bits", type=int, choices=[8, 16], default=8)
+    parser.add_argument("--formats", nargs="+", default=["tiff", "png"])
+    args = parser.parse_args()
+
+    print(f"cpus: {os.cpu_count()}")
+    print(
+        f"{'MP':>4} {'brackets':>8} {'format':<6} {'serial':>8} {'parallel':>9} {'speedup':>8}"
+    )
+    folder = os.environ.get("NIK_TEMP_PATH") or tempfile.gettempdir()
+    for megapixels in args.sizes:
+        for count in args.brackets:
+            brackets = [make_pixels(megapixels, args.bits) for _ in range(count)]
+            for fmt in args.formats:
+                with tempfile.TemporaryDirectory(dir=folder) as tmp_dir:
+                    serial, serial_digests = encode(brackets, fmt, tmp_dir, 1)
+                    parallel, parallel_digests = encode(brackets, fmt, tmp_dir, 0)
+                assert serial_digests == parallel_digests, "parallel output differs"
+                print(
+                    f"{megapixels:>4} {count:>8} {fmt:<6} {serial:>7.2f}s"
+                    f" {parallel:>8.2f}s {serial / parallel:>7.2f}x"
+                )
+            del brackets
+
+
+if __name__ == "__main__":
+    main()
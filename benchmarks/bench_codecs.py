@@ -0,0 +1,85 @@
+"""
+Built-in codecs (nikimage.py) vs GIMP's file plug-ins for the intermediate files:
+export of a layer and import of a result into it, for uncompressed TIFF and PNG
+
+Runs inside GIMP (it measures the real file plug-ins), from the repository root:
+    gimp-console-3.0 -i --batch-interpreter=python-fu-eval \
+        -b "exec(open('benchmarks/bench_codecs.py').read())" -b "Gimp.quit()"
+Both import paths must produce the same pixels, checked on the first run of each case.
+"""
+
+import gi
+
+gi.require_version("Gimp", "3.0")
+from gi.repository import Gimp
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [os.getcwd(), os.path.join(os.getcwd(), "benchmarks")]
+import nikcore
+from bench_formats import make_image
+from nikplugin import (
+    ExportSettings,
+    FileFormat,
+    export_images,
+    process_result,
+    read_pixels,
+)
+
+# full HD, 12 MP, 24 MP, 50 MP
+SIZES = [(1920, 1080), (4240, 2832), (6000, 4000), (8660, 5774)]
+SETTINGS = [
+    ExportSettings(fmt=FileFormat.TIFF),
+    ExportSettings(fmt=FileFormat.PNG, png_level=1),
+]
+REPEAT = 3
+
+
+def measure(layer: Gimp.Layer, settings: ExportSettings, folder: str, builtin: bool):
+    """Best of REPEAT runs for export and import, and the imported pixels"""
+
+    nikcore.BUILTIN_CODECS = builtin
+    size = (layer.get_width(), layer.get_height())
+    export, load = [], []
+    pixels = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        [path] = export_images([layer], settings, folder)
+        export.append(time.perf_counter() - start)
+
+        target = layer.copy()
+        layer.get_image().insert_layer(target, None, 0)
+        start = time.perf_counter()
+        process_result(target, size, path)
+        load.append(time.perf_counter() - start)
+        pixels = pixels or read_pixels(target).data
+        layer.get_image().remove_layer(target)
+    return min(export), min(load), pixels
+
+
+def main() -> None:
+    print(f"{'size':>11} {'format':<8} {'path':<8} {'export':>8} {'import':>8}")
+    with tempfile.TemporaryDirectory(prefix="nikbench-") as tmp_dir:
+        for width, height in SIZES:
+            image = make_image(width, height)
+            image.undo_disable()
+            layer = image.get_layers()[0]
+            for settings in SETTINGS:
+                results = {}
+                for label, builtin in (("gimp", False), ("builtin", True)):
+                    export, load, pixels = measure(layer, settings, tmp_dir, builtin)
+                    results[label] = pixels
+                    print(
+                        f"{width:>5}x{height:<5} {settings.fmt.value:<8} {label:<8}"
+                        f" {export:>7.2f}s {load:>7.2f}s"
+                    )
+                assert results["gimp"] == results["builtin"], "imports differ"
+            image.delete()
+    nikcore.BUILTIN_CODECS = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Encode + decode wall time and file size of the intermediate formats
+
+Runs inside GIMP (it measures the real file plug-ins), from the repository root:
+    gimp-console-3.0 -i --batch-interpreter=python-fu-eval \
+        -b "exec(open('benchmarks/bench_formats.py').read())" -b "Gimp.quit()"
+"""
+
+import gi
+
+gi.require_version("Gimp", "3.0")
+from gi.repository import Gimp, Gio
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+from nikplugin import ExportSettings, FileFormat, save_image
+
+# typical sizes: full HD, 24 MP, 50 MP
+SIZES = [(1920, 1080), (6000, 4000), (8660, 5774)]
+SETTINGS = [
+    ExportSettings(fmt=FileFormat.TIFF),
+    ExportSettings(fmt=FileFormat.TIFF_LZW),
+    ExportSettings(fmt=FileFormat.PNG, png_level=1),
+    ExportSettings(fmt=FileFormat.PNG, png_level=6),
+    ExportSettings(fmt=FileFormat.JPEG, jpeg_quality=95),
+]
+REPEAT = 3
+
+
+def make_image(width: int, height: int) -> Gimp.Image:
+    """Image with photo-like content, flat fills would flatter compression"""
+
+    image = Gimp.Image.new(width, height, Gimp.ImageBaseType.RGB)
+    layer = Gimp.Layer.new(
+        image,
+        "bench",
+        width,
+        height,
+        Gimp.ImageType.RGB_IMAGE,
+        100,
+        Gimp.LayerMode.NORMAL,
+    )
+    image.insert_layer(layer, None, 0)
+    plasma = Gimp.get_pdb().lookup_procedure("plug-in-plasma")
+    config = plasma.create_config()
+    config.set_property("run-mode", Gimp.RunMode.NONINTERACTIVE)
+    config.set_property("image", image)
+    config.set_property("drawables", [layer])
+    config.set_property("seed", 42)
+    config.set_property("turbulence", 2.0)
+    plasma.run(config)
+    return image
+
+
+def measure(image: Gimp.Image, settings: ExportSettings, path: str):
+    """Best of REPEAT runs for encode and decode, plus the file size"""
+
+    encode, decode = [], []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        save_image(image, path, settings)
+        encode.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        loaded = Gimp.file_load(
+            Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(path)
+        )
+        decode.append(time.perf_counter() - start)
+        loaded.delete()
+    return min(encode), min(decode), os.path.getsize(path)
+
+
+def main() -> None:
+    print(
+        f"{'size':>11} {'format':<12} {'encode':>8} {'decode':>8} {'total':>8} {'MiB':>8}"
+    )
+    with tempfile.TemporaryDirectory(prefix="nikbench-") as tmp_dir:
+        for width, height in SIZES:
+            image = make_image(width, height)
+            for settings in SETTINGS:
+                fmt = settings.fmt
+                label = fmt.value
+                if fmt == FileFormat.PNG:
+                    label += f"-{settings.png_level}"
+                elif fmt == FileFormat.JPEG:
+                    label += f"-{settings.jpeg_quality}"
+                path = os.path.join(tmp_dir, f"bench{fmt.suffix}")
+                enc, dec, size = measure(image, settings, path)
+                print(
+                    f"{width:>5}x{height:<5} {label:<12} {enc:>7.2f}s {dec:>7.2f}s"
+                    f" {enc + dec:>7.2f}s {size / 2**20:>8.1f}"
+                )
+            image.delete()
+
+
+# python-fu-eval runs the code as __main__, bench_codecs.py imports make_image()
+if __name__ == "__main__":
+    main()
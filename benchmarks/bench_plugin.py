@@ -0,0 +1,288 @@
+"""
+Plugin overhead without GIMP or Nik: discovery, export, detection and reimport
+
+A fake `gi` (benchmarks/fakegi) stands in for GIMP and stub programs (nikstub.py) for Nik,
+installed into a throw-away Wine-like home folder. The stubs invert the image after --delay
+seconds, 'HDR Efex Pro 2' writes '<name>_HDR' into the fake Documents folder instead.
+Runs on Linux, every stage is the median of --repeat runs, timed by nikcore.Trace:
+    export   layers to intermediate files
+    run      program stage minus the stub's delay, i.e. launch, the stub's own I/O, polling
+    collect  waiting for the result to settle, comparing hashes, moving the HDR output
+    import   result back into the target layer
+--area 0.05 lets the stubs change only that share of the image, --changed-tiles writes back
+just the changed tiles (WRITE_CHANGED_TILES), the import stage then follows the area.
+--each compares one launch per layer with one launch for all layers (MULTI_FILE_PROGS).
+
+Usage, from the repository root:
+    python3 benchmarks/bench_plugin.py [--sizes 2 12 24] [--layers 1 3] [--formats tiff png]
+    python3 benchmarks/bench_plugin.py --area 0.05 [--changed-tiles]
+    python3 benchmarks/bench_plugin.py --each --layers 4 8
+    python3 benchmarks/bench_plugin.py --save benchmarks/baseline.json
+    python3 benchmarks/bench_plugin.py --compare benchmarks/baseline.json [--threshold 0.25]
+Comparing exits with 1 if a stage got slower than the baseline by more than the threshold.
+"""
+
+from pathlib import Path
+from typing import Dict, List
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path[:0] = [str(BENCH_DIR / "fakegi"), str(BENCH_DIR), str(REPO_DIR)]
+
+from bench_brackets import make_pixels  # noqa: E402
+from nikstub import invert  # noqa: E402
+from gi.repository import Gimp  # noqa: E402
+
+PROGS = ["HDR Efex Pro 2", "Viveza 2"]
+WINE_USER = "bench"
+# Differences below this (seconds) are noise, never a regression
+MIN_REGRESSION = 0.005
+
+Results = Dict[str, Dict[str, float]]
+
+
+def install_stubs(root: Path) -> Dict[str, str]:
+    """Fake home with the stub programs in a Wine prefix, returns the environment"""
+
+    home = root / "home"
+    drive_c = home / ".wine/drive_c"
+    for prog_name in PROGS:
+        prog_dir = drive_c / "Program Files/Google/Nik Collection" / prog_name
+        prog_dir.mkdir(parents=True)
+        exe = prog_dir / f"{prog_name}.exe"
+        shutil.copyfile(BENCH_DIR / "nikstub.py", exe)
+        exe.chmod(0o755)
+    documents = drive_c / f"users/{WINE_USER}/My Documents"
+    documents.mkdir(parents=True)
+
+    # 'wine program.exe files' runs the stub directly
+    bin_dir = root / "bin"
+    bin_dir.mkdir()
+    wine = bin_dir / "wine"
+    wine.write_text('#!/bin/sh\nexec "$@"\n', encoding="utf-8")
+    wine.chmod(0o755)
+
+    return {
+        "HOME": str(home),
+        "USER": WINE_USER,
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        "NIKSTUB_DOCUMENTS": str(documents),
+        "NIKSTUB_REPO": str(REPO_DIR),
+    }
+
+
+def bench_discovery(nikcore, config_dir: Path, repeat: int) -> Dict[str, float]:
+    """Cold scan of the installation vs loading the discovery index"""
+
+    timings: Dict[str, List[float]] = {"scan": [], "index": []}
+    for _ in range(repeat):
+        for stage, values in timings.items():
+            nikcore._PROGS = None  # pylint: disable=W0212
+            if stage == "scan" and (cache := nikcore.get_cache_path(config_dir)):
+                cache.unlink(missing_ok=True)
+            start = time.perf_counter()
+            progs = nikcore.discover_progs(config_dir)
+            values.append(time.perf_counter() - start)
+            assert len(progs) == len(PROGS), f"stubs not found: {progs}"
+    return {stage: statistics.median(values) for stage, values in timings.items()}
+
+
+def bench_case(nikplugin, trace_path: Path, args, case) -> Dict[str, float]:
+    """Median stage timings of one size/layers/format combination"""
+
+    megapixels, n_layers, fmt = case
+    pixels = make_pixels(megapixels, args.bits)
+    precision = (
+        Gimp.Precision.U8_NON_LINEAR
+        if args.bits == 8
+        else Gimp.Precision.U16_NON_LINEAR
+    )
+    image = Gimp.Image.new_with_precision(pixels.width, pixels.height, 0, precision)
+    layers = [Gimp.Layer(image, pixels) for _ in range(n_layers)]
+    prog_name = PROGS[0] if n_layers > 1 else PROGS[1]
+    prog_idx = nikplugin.list_progs().index(prog_name)
+    settings = nikplugin.ExportSettings(fmt=nikplugin.FileFormat(fmt))
+
+    timings: Dict[str, List[float]] = {}
+    for i in range(args.repeat):
+        trace = nikplugin.Trace(trace_path, prog=prog_name)
+        run_settings, run_workspace = nikplugin.admit_run(
+            nikplugin.layer_sizes(layers), settings, prog_name, trace
+        )
+        with run_workspace as workspace:
+            result = nikplugin.run_nik(
+                prog_idx, layers, run_settings, workspace, 0, trace
+            )
+            assert result, f"no result detected for {case}"
+            target = Gimp.Layer.new_from_drawable(layers[0], image)
+            with trace.stage("import"):
+                tiles = nikplugin.process_result(
+                    target, (pixels.width, pixels.height), result
+                )
+        if i == 0:
+            expected = invert(pixels, args.area)
+            assert target.get_buffer().data == expected, f"wrong result for {case}"
+            if tiles:
+                print(f"{case}: {tiles[0]} of {tiles[1]} tiles changed")
+        stages = dict(trace.stages)
+        stages["run"] = stages.pop("program") - args.delay
+        for stage, elapsed in stages.items():
+            timings.setdefault(stage, []).append(elapsed)
+
+    medians = {stage: statistics.median(values) for stage, values in timings.items()}
+    medians["overhead"] = sum(medians.values())
+    return medians
+
+
+def bench_each(nikcore, nikplugin, trace_path: Path, args, case) -> Dict[str, float]:
+    """Selected layers of one size/count/format: one launch each vs all in one launch"""
+
+    megapixels, n_layers, fmt = case
+    pixels = make_pixels(megapixels, args.bits)
+    precision = (
+        Gimp.Precision.U8_NON_LINEAR
+        if args.bits == 8
+        else Gimp.Precision.U16_NON_LINEAR
+    )
+    image = Gimp.Image.new_with_precision(pixels.width, pixels.height, 0, precision)
+    prog_idx = nikplugin.list_progs().index(PROGS[1])
+    settings = nikplugin.ExportSettings(fmt=nikplugin.FileFormat(fmt))
+
+    totals: Dict[str, float] = {}
+    for mode, multi in (("each", ()), ("multi", (PROGS[1].split()[0].lower(),))):
+        nikcore.MULTI_FILE_PROGS = multi
+        values = []
+        for _ in range(args.repeat):
+            layers = [Gimp.Layer(image, pixels) for _ in range(n_layers)]
+            trace = nikplugin.Trace(trace_path, prog=PROGS[1])
+            start = time.perf_counter()
+            changed, _ = nikplugin.run_each_layer(
+                [prog_idx], layers, settings, 0, trace
+            )
+            values.append(time.perf_counter() - start)
+            assert changed == n_layers, f"{changed} of {n_layers} changed for {case}"
+        totals[mode] = statistics.median(values)
+    nikcore.MULTI_FILE_PROGS = ()
+    return totals
+
+
+def compare(results: Results, baseline_path: Path, threshold: float) -> int:
+    """Print stages slower than the baseline, returns their count"""
+
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline: Results = json.load(file)["results"]
+    regressions = 0
+    for key, stages in results.items():
+        for stage, elapsed in stages.items():
+            if (base := baseline.get(key, {}).get(stage)) is None:
+                continue
+            if elapsed > base * (1 + threshold) and elapsed - base > MIN_REGRESSION:
+                regressions += 1
+                print(
+                    f"REGRESSION {key} {stage}: {base * 1000:.1f}ms"
+                    f" -> {elapsed * 1000:.1f}ms (+{(elapsed / base - 1) * 100:.0f}%)"
+                )
+    print(f"{regressions} regression(s) against {baseline_path}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Plugin overhead with stub programs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 12, 24])
+    parser.add_argument("--layers", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--formats", nargs="+", default=["tiff", "png"])
+    parser.add_argument("--bits", type=int, choices=[8, 16], default=8)
+    parser.add_argument("--delay", type=float, default=0.2, help="stub runtime (s)")
+    parser.add_argument("--area", type=float, default=1.0, help="share changed")
+    parser.add_argument("--changed-tiles", action="store_true")
+    parser.add_argument("--each", action="store_true", help="selected layers mode")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", type=Path, help="store the results as baseline")
+    parser.add_argument("--compare", type=Path, help="baseline to check against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        parser.error("the stub installation mimics Wine, Linux only")
+
+    folder = os.environ.get("NIK_TEMP_PATH") or tempfile.gettempdir()
+    root = Path(tempfile.mkdtemp(prefix="nikbench-", dir=folder))
+    try:
+        os.environ.update(
+            install_stubs(root),
+            NIKSTUB_DELAY=str(args.delay),
+            NIKSTUB_AREA=str(args.area),
+        )
+        config_dir = root / "config"
+        config_dir.mkdir()
+        Gimp.config_dir = str(config_dir)
+        import nikcore  # pylint: disable=C0415
+        import nikplugin  # pylint: disable=C0415
+
+        nikcore.WRITE_CHANGED_TILES = args.changed_tiles
+
+        results: Results = {"discovery": bench_discovery(nikcore, config_dir, 5)}
+        discovery = results["discovery"]
+        print(
+            f"discovery: scan {discovery['scan']:.4f}s, index {discovery['index']:.4f}s"
+        )
+
+        if args.each:
+            print(f"{'MP':>4} {'layers':>6} {'format':<6} {'each':>9} {'multi':>9}")
+            for case in itertools.product(args.sizes, args.layers, args.formats):
+                totals = bench_each(
+                    nikcore, nikplugin, root / "trace.jsonl", args, case
+                )
+                print(
+                    f"{case[0]:>4} {case[1]:>6} {case[2]:<6} "
+                    f"{totals['each']:>8.3f}s {totals['multi']:>8.3f}s"
+                )
+            return 0
+
+        stages = ["export", "run", "collect", "import", "overhead"]
+        print(
+            f"{'MP':>4} {'layers':>6} {'format':<6} "
+            + " ".join(f"{s:>9}" for s in stages)
+        )
+        for megapixels in args.sizes:
+            for n_layers in args.layers:
+                for fmt in args.formats:
+                    case = (megapixels, n_layers, fmt)
+                    medians = bench_case(nikplugin, root / "trace.jsonl", args, case)
+                    results[f"{megapixels}MP/{n_layers}L/{fmt}/{args.bits}bit"] = (
+                        medians
+                    )
+                    print(
+                        f"{megapixels:>4} {n_layers:>6} {fmt:<6} "
+                        + " ".join(f"{medians[s]:>8.3f}s" for s in stages)
+                    )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.save:
+        data = {
+            "machine": platform.node(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "results": results,
+        }
+        args.save.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline saved to {args.save}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Startup cost of the plugin as GIMP pays it at every launch: interpreter, imports and
+the registration (query and create of all procedures), each in a fresh process
+
+With the fake `gi` (benchmarks/fakegi) only the plugin's own Python side is measured and
+the stub installation of bench_plugin.py is discovered. With --real-gi the installed
+GIMP 3 bindings are imported, registration needs a running GIMP and is skipped then.
+--ref measures the plugin files of a git revision as well, e.g. to show a change's gain.
+
+Usage, from the repository root:
+    python3 benchmarks/bench_startup.py [--ref HEAD~1] [--repeat 20] [--real-gi]
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+PLUGIN_FILES = ["nikplugin.py", "nikcore.py", "nikimage.py"]
+
+# Runs in the child, prints its timings as json
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+from gi.repository import Gimp
+if hasattr(Gimp, "config_dir"):
+    Gimp.config_dir = os.environ["NIKBENCH_CONFIG"]
+gi_done = time.perf_counter()
+import nikplugin
+imported = time.perf_counter()
+if hasattr(Gimp, "config_dir"):
+    plugin = nikplugin.NikPlugin()
+    for name in plugin.do_query_procedures():
+        plugin.do_create_procedure(name)
+registered = time.perf_counter()
+heavy = [m for m in ("gi.repository.Gtk", "concurrent.futures", "ctypes", "hashlib",
+    "subprocess", "threading")
+         if m in sys.modules]
+print(json.dumps({
+    "import": imported - gi_done,
+    "register": registered - imported,
+    "modules": len(sys.modules),
+    "heavy": heavy,
+}))
+"""
+
+
+def extract_ref(ref: str, folder: Path) -> None:
+    for name in PLUGIN_FILES:
+        content = subprocess.run(
+            ["git", "show", f"{ref}:{name}"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            check=False,
+        )
+        if content.returncode == 0:
+            (folder / name).write_bytes(content.stdout)
+
+
+def measure(tree: Path, env: Dict[str, str], real_gi: bool, repeat: int) -> Dict:
+    paths = [str(tree)] if real_gi else [str(BENCH_DIR / "fakegi"), str(tree)]
+    env = {**env, "PYTHONPATH": os.pathsep.join(paths)}
+    samples: Dict[str, List[float]] = {"total": [], "import": [], "register": []}
+    info: Dict = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=tree,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if proc.returncode:
+            raise RuntimeError(f"{tree}: {proc.stderr.strip()}")
+        samples["total"].append(time.perf_counter() - start)
+        info = json.loads(proc.stdout.strip().splitlines()[-1])
+        samples["import"].append(info["import"])
+        samples["register"].append(info["register"])
+    result = {name: statistics.median(values) for name, values in samples.items()}
+    result.update(modules=info["modules"], heavy=info["heavy"])
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Plugin startup time")
+    parser.add_argument("--ref", help="git revision to compare with, e.g. HEAD~1")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--real-gi", action="store_true", help="use installed gi")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="nikbench-"))
+    try:
+        env = dict(os.environ)
+        config_dir = root / "config"
+        config_dir.mkdir()
+        env["NIKBENCH_CONFIG"] = str(config_dir)
+        if not args.real_gi and sys.platform.startswith("linux"):
+            sys.path.insert(0, str(BENCH_DIR))
+            from bench_plugin import install_stubs  # pylint: disable=C0415
+
+            env.update(install_stubs(root))
+
+        trees = [("working tree", REPO_DIR)]
+        if args.ref:
+            ref_dir: Optional[Path] = root / "ref"
+            ref_dir.mkdir()
+            extract_ref(args.ref, ref_dir)
+            trees.insert(0, (args.ref, ref_dir))
+
+        print(
+            f"{'tree':<14} {'process':>9} {'import':>9} {'register':>9} {'modules':>8}  heavy"
+        )
+        for label, tree in trees:
+            # first run writes the discovery index, as the very first GIMP start does
+            measure(tree, env, args.real_gi, 1)
+            result = measure(tree, env, args.real_gi, args.repeat)
+            print(
+                f"{label:<14} {result['total'] * 1000:>7.1f}ms"
+                f" {result['import'] * 1000:>7.1f}ms {result['register'] * 1000:>7.1f}ms"
+                f" {result['modules']:>8}  {', '.join(result['heavy']) or '-'}"
+            )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Cold vs warm Wine launch latency (Linux)
+
+Cold: no wineserver is running, the launch boots the Wine prefix first.
+Warm: a persistent wineserver is kept up as with WINE_WARM_SECONDS in nikcore.py.
+The probe is a trivial Windows command, so the difference is the saving per Nik launch.
+
+Usage, from the repository root:
+    python3 benchmarks/bench_wine.py [--prefix ~/.wine] [--repeat 5]
+"""
+
+from pathlib import Path
+from typing import Dict, List
+
+import argparse
+import os
+import statistics
+import subprocess
+import time
+
+PROBE = ["wine", "cmd", "/c", "exit"]
+
+
+def launch_time(env: Dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(PROBE, env=env, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def kill_wineserver(env: Dict[str, str]) -> None:
+    subprocess.run(["wineserver", "-k"], env=env, capture_output=True, check=False)
+    subprocess.run(["wineserver", "-w"], env=env, capture_output=True, check=False)
+
+
+def measure(env: Dict[str, str], repeat: int) -> Dict[str, List[float]]:
+    cold, warm = [], []
+    for _ in range(repeat):
+        kill_wineserver(env)
+        cold.append(launch_time(env))
+
+    kill_wineserver(env)
+    subprocess.run(["wineserver", "--persistent=60"], env=env, check=True)
+    # first launch boots the prefix, measure the following ones
+    launch_time(env)
+    for _ in range(repeat):
+        warm.append(launch_time(env))
+    kill_wineserver(env)
+    return {"cold": cold, "warm": warm}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold vs warm Wine launch latency")
+    parser.add_argument("--prefix", type=Path, default=Path.home() / ".wine")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    env = {**os.environ, "WINEPREFIX": str(args.prefix), "WINEDEBUG": "-all"}
+    results = measure(env, args.repeat)
+    for name, times in results.items():
+        print(
+            f"{name:>5}: median {statistics.median(times):.3f}s"
+            f"  min {min(times):.3f}s  max {max(times):.3f}s"
+        )
+    saving = statistics.median(results["cold"]) - statistics.median(results["warm"])
+    print(f"saving per launch: {saving:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
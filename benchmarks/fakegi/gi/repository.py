@@ -0,0 +1,302 @@
+"""
+Fake GIMP bindings used by the plugin benchmark
+Layers keep their pixels as interleaved bytes of one babl format, buffers don't convert.
+Everything the benchmark doesn't exercise (dialogs, PDB, registration) is a no-op.
+"""
+
+from enum import IntEnum
+from types import SimpleNamespace
+from typing import List, Optional
+
+# NOTE: only formats written by pixel_format() in nikplugin.py
+BPP = {"Y'": 1, "Y'A": 2, "R'G'B'": 3, "R'G'B'A": 4}
+
+
+def format_bpp(babl_format: str) -> int:
+    color, kind = babl_format.split()
+    return BPP[color] * (2 if kind == "u16" else 1)
+
+
+class _Namespace:
+    """Accepts any attribute access and call, for the parts not benchmarked"""
+
+    def __getattr__(self, name: str) -> "_Namespace":
+        return self
+
+    def __call__(self, *args, **kwargs) -> "_Namespace":
+        return self
+
+
+class Rectangle(SimpleNamespace):
+    @classmethod
+    def new(cls, x: int, y: int, width: int, height: int) -> "Rectangle":
+        return cls(x=x, y=y, width=width, height=height)
+
+
+class Buffer:
+    def __init__(self, width: int, height: int, babl_format: str, data=None) -> None:
+        self.extent = Rectangle.new(0, 0, width, height)
+        self.format = babl_format
+        self.bpp = format_bpp(babl_format)
+        self.data = bytearray(data if data is not None else width * height * self.bpp)
+
+    def get_extent(self) -> Rectangle:
+        return self.extent
+
+    def check(self, babl_format: str) -> None:
+        if babl_format != self.format:
+            raise NotImplementedError(f"no conversion {self.format} -> {babl_format}")
+
+    def spans(self, rect: Rectangle) -> List[slice]:
+        """Byte ranges of the rect's rows, full-width bands as one"""
+
+        row_size = self.extent.width * self.bpp
+        if rect.x == 0 and rect.width == self.extent.width:
+            return [slice(rect.y * row_size, (rect.y + rect.height) * row_size)]
+        left, right = rect.x * self.bpp, (rect.x + rect.width) * self.bpp
+        return [
+            slice(row * row_size + left, row * row_size + right)
+            for row in range(rect.y, rect.y + rect.height)
+        ]
+
+    def get(self, rect: Rectangle, scale: float, babl_format: str, abyss) -> bytes:
+        del scale, abyss
+        self.check(babl_format)
+        return b"".join(self.data[span] for span in self.spans(rect))
+
+    def set(self, rect: Rectangle, babl_format: str, data: bytes) -> None:
+        self.check(babl_format)
+        pos = 0
+        for span in self.spans(rect):
+            size = span.stop - span.start
+            self.data[span] = data[pos : pos + size]
+            pos += size
+
+    def flush(self) -> None:
+        return None
+
+
+class Gegl:
+    Rectangle = Rectangle
+    Buffer = Buffer
+    AbyssPolicy = SimpleNamespace(NONE=0)
+
+    @staticmethod
+    def init(args) -> None:
+        return None
+
+
+class Precision(IntEnum):
+    U8_LINEAR = 100
+    U8_NON_LINEAR = 150
+    U8_PERCEPTUAL = 175
+    U16_LINEAR = 200
+    U16_NON_LINEAR = 250
+    U16_PERCEPTUAL = 275
+
+
+class Image:
+    __gtype__ = "GimpImage"
+
+    def __init__(self, width: int, height: int, base_type: int, precision: int):
+        self.width, self.height = width, height
+        self.base_type, self.precision = base_type, precision
+        self.layers: List["Layer"] = []
+
+    @classmethod
+    def new_with_precision(cls, width, height, base_type, precision) -> "Image":
+        return cls(width, height, base_type, precision)
+
+    def get_width(self) -> int:
+        return self.width
+
+    def get_height(self) -> int:
+        return self.height
+
+    def get_base_type(self) -> int:
+        return self.base_type
+
+    def get_precision(self) -> int:
+        return self.precision
+
+    def get_color_profile(self) -> None:
+        return None
+
+    def get_selected_layers(self) -> List["Layer"]:
+        return self.layers[:1]
+
+    def insert_layer(self, layer: "Layer", parent, position: int) -> None:
+        del parent
+        layer.image = self
+        self.layers.insert(position, layer)
+
+    def remove_layer(self, layer: "Layer") -> None:
+        self.layers.remove(layer)
+
+    def select_rectangle(self, *args) -> None:
+        return None
+
+    def select_item(self, *args) -> None:
+        return None
+
+    def undo_disable(self) -> None:
+        return None
+
+    def delete(self) -> None:
+        self.layers.clear()
+
+
+class Layer:
+    __gtype__ = "GimpLayer"
+
+    def __init__(self, image: Optional[Image], pixels) -> None:
+        """Layer holding the pixels of a nikimage.PixelData"""
+        self.image = image
+        color = "Y'" if pixels.channels <= 2 else "R'G'B'"
+        alpha = "A" if pixels.channels in (2, 4) else ""
+        self.buffer = Buffer(
+            pixels.width,
+            pixels.height,
+            f"{color}{alpha} u{pixels.bits}",
+            pixels.data,
+        )
+        self.shadow: Optional[Buffer] = None
+        self.offsets = [0, 0]
+
+    @classmethod
+    def new_from_drawable(cls, drawable: "Layer", image: Image) -> "Layer":
+        layer = cls.__new__(cls)
+        layer.image = image
+        layer.buffer = Buffer(
+            drawable.get_width(),
+            drawable.get_height(),
+            drawable.buffer.format,
+            drawable.buffer.data,
+        )
+        layer.shadow = None
+        layer.offsets = list(drawable.offsets)
+        return layer
+
+    def get_image(self) -> Image:
+        return self.image
+
+    def get_width(self) -> int:
+        return self.buffer.extent.width
+
+    def get_height(self) -> int:
+        return self.buffer.extent.height
+
+    def get_bpp(self) -> int:
+        return self.buffer.bpp
+
+    def is_gray(self) -> bool:
+        return self.buffer.format.startswith("Y'")
+
+    def has_alpha(self) -> bool:
+        return "A " in self.buffer.format
+
+    def get_buffer(self) -> Buffer:
+        return self.buffer
+
+    def get_shadow_buffer(self) -> Buffer:
+        # starts as a copy, without selections a merge then applies just what was set
+        extent = self.buffer.extent
+        self.shadow = Buffer(
+            extent.width, extent.height, self.buffer.format, self.buffer.data
+        )
+        return self.shadow
+
+    def merge_shadow(self, push_undo: bool) -> None:
+        del push_undo
+        self.buffer.data[:] = self.shadow.data
+
+    def get_offsets(self) -> tuple:
+        return (True, *self.offsets)
+
+    def update(self, x: int, y: int, width: int, height: int) -> None:
+        return None
+
+    def resize(self, width: int, height: int, offset_x: int, offset_y: int) -> None:
+        del offset_x, offset_y
+        self.buffer = Buffer(width, height, self.buffer.format)
+
+    def set_offsets(self, x: int, y: int) -> None:
+        self.offsets = [x, y]
+
+
+class Item:
+    @staticmethod
+    def transform_translate(item: Layer, dx: float, dy: float) -> None:
+        item.offsets = [item.offsets[0] + dx, item.offsets[1] + dy]
+
+
+class File(SimpleNamespace):
+    @classmethod
+    def new_for_path(cls, path: str) -> "File":
+        return cls(path=path)
+
+    def get_path(self) -> str:
+        return self.path
+
+
+class Gio:
+    File = File
+
+
+class _Gimp(_Namespace):
+    """Module-like object, unknown names fall back to no-ops"""
+
+    Precision = Precision
+    Image = Image
+    Layer = Layer
+    Item = Item
+    RunMode = SimpleNamespace(INTERACTIVE=0, NONINTERACTIVE=1)
+    PDBStatusType = SimpleNamespace(
+        EXECUTION_ERROR=0, CALLING_ERROR=1, PASS_THROUGH=2, SUCCESS=3, CANCEL=4
+    )
+    ImageBaseType = SimpleNamespace(RGB=0, GRAY=1)
+    PlugIn = object
+    config_dir = "."
+
+    @staticmethod
+    def directory() -> str:
+        return Gimp.config_dir
+
+    @staticmethod
+    def tile_height() -> int:
+        return 64
+
+    @staticmethod
+    def tile_width() -> int:
+        return 64
+
+    @staticmethod
+    def progress_init(text: str) -> bool:
+        return True
+
+    @staticmethod
+    def progress_update(fraction: float) -> bool:
+        return True
+
+    @staticmethod
+    def progress_pulse() -> bool:
+        return True
+
+    @staticmethod
+    def progress_set_text(text: str) -> bool:
+        return True
+
+    @staticmethod
+    def file_load_layer(run_mode, image: Image, file: File) -> Layer:
+        # imported on use to keep the startup measurement free of it
+        import nikstub  # pylint: disable=C0415
+
+        del run_mode
+        return Layer(image, nikstub.load_pixels(file.get_path()))
+
+
+Gimp = _Gimp()
+GimpUi = _Namespace()
+GLib = _Namespace()
+GObject = _Namespace()
+Gtk = _Namespace()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Stand-in for a Nik program used by bench_plugin.py, copied as '<program>.exe'
+
+After NIKSTUB_DELAY seconds it inverts the pixels of each file and saves it
+in the same format, like a Nik program saving its result over the input.
+With NIKSTUB_AREA below 1 only a centered rectangle of that share of the image is inverted.
+Programs named 'HDR Efex*' save '<name>_HDR<ext>' into NIKSTUB_DOCUMENTS instead.
+Only files written by nikimage.py (uncompressed TIFF, unfiltered PNG) are understood.
+"""
+
+from array import array
+from pathlib import Path
+
+import os
+import struct
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.environ.get("NIKSTUB_REPO", str(Path(__file__).parent.parent)))
+from nikimage import PixelData, open_image, write_image  # noqa: E402
+
+
+def load_png(path: str) -> PixelData:
+    """PNG without row filters as written by write_png()"""
+
+    with open(path, "rb") as file:
+        raw = file.read()
+    pos, idat, header = 8, [], None
+    while pos < len(raw):
+        (length,) = struct.unpack(">I", raw[pos : pos + 4])
+        kind, body = raw[pos + 4 : pos + 8], raw[pos + 8 : pos + 8 + length]
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBB", body[:10])
+        elif kind == b"IDAT":
+            idat.append(body)
+        pos += 12 + length
+
+    width, height, bits, color_type = header
+    channels = {0: 1, 4: 2, 2: 3, 6: 4}[color_type]
+    row_size = width * channels * bits // 8
+    rows = zlib.decompress(b"".join(idat))
+    if any(rows[y * (row_size + 1)] for y in range(height)):
+        raise ValueError(f"Filtered PNG not supported: {path}")
+    data = b"".join(
+        rows[y * (row_size + 1) + 1 : (y + 1) * (row_size + 1)] for y in range(height)
+    )
+    if bits == 16 and sys.byteorder == "little":
+        swapped = array("H", data)
+        swapped.byteswap()
+        data = swapped.tobytes()
+    return PixelData(width, height, channels, bits, data)
+
+
+def load_pixels(path: str) -> PixelData:
+    if reader := open_image(path):
+        with reader:
+            data = reader.read_rows(0, reader.height)
+            return PixelData(
+                reader.width, reader.height, reader.channels, reader.bits, data
+            )
+    return load_png(path)
+
+
+def invert(pixels: PixelData, area: float) -> bytes:
+    """Pixels inverted within a centered rectangle covering the share area of the image"""
+
+    # inverting every byte inverts 16-bit samples as well
+    table = bytes(range(255, -1, -1))
+    if area >= 1:
+        return pixels.data.translate(table)
+    width, height = int(pixels.width * area**0.5), int(pixels.height * area**0.5)
+    left, top = (pixels.width - width) // 2, (pixels.height - height) // 2
+    bpp = pixels.row_size // pixels.width
+    data = bytearray(pixels.data)
+    for row in range(top, top + height):
+        start = row * pixels.row_size + left * bpp
+        data[start : start + width * bpp] = data[start : start + width * bpp].translate(
+            table
+        )
+    return bytes(data)
+
+
+def main() -> int:
+    time.sleep(float(os.environ.get("NIKSTUB_DELAY", "0")))
+    is_hdr = Path(sys.argv[0]).stem.lower().startswith("hdr efex")
+    # HDR Efex merges its inputs, the others process every file they are given
+    for source in map(Path, sys.argv[1:2] if is_hdr else sys.argv[1:]):
+        pixels = load_pixels(str(source))
+        result = PixelData(
+            pixels.width,
+            pixels.height,
+            pixels.channels,
+            pixels.bits,
+            invert(pixels, float(os.environ.get("NIKSTUB_AREA", "1"))),
+        )
+
+        target = source
+        if is_hdr:
+            target = (
+                Path(os.environ["NIKSTUB_DOCUMENTS"])
+                / f"{source.stem}_HDR{source.suffix}"
+            )
+        fmt = "png" if source.suffix.lower() == ".png" else "tiff"
+        write_image(str(target), result, fmt)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
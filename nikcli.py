@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""
+Command-line driver running Nik Collection programs on image files without GIMP
+
+USAGE:
+    python3 nikcli.py list
+    python3 nikcli.py run --prog "Viveza 2" photo1.jpg photo2.tif
+    python3 nikcli.py run --prog 3 --output ~/done *.jpg
+    python3 nikcli.py report [trace.jsonl]
+    python3 nikcli.py cache [--clear]
+
+Each file is handed over in its own format, i.e. it must be one the program can open (jpg, tif).
+Results are written into the output folder (default: 'nik/' next to the input) under the input name.
+Files for HDR Efex Pro are merged into one result named after the first file.
+The report summarizes the stage timings traced by the plugin (see TRACE_FILENAME in nikcore.py).
+
+LICENSE:
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+This program is licensed under the GNU General Public License v3 (GPLv3).
+
+CONTRIBUTING:
+For bug fixes & updates: https://iiey.github.io/nikgimp
+Issues and contributing: https://github.com/iiey/nikgimp
+"""
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import argparse
+import shutil
+import subprocess
+import sys
+
+from nikcore import (
+    Workspace,
+    NIK_TIMEOUT,
+    ResultCache,
+    ResultWatcher,
+    build_command,
+    child_usage,
+    discover_progs,
+    find_prog,
+    get_program_env,
+    get_trace_path,
+    is_hdr_prog,
+    load_traces,
+    percentile,
+    run_program,
+    summarize_traces,
+    usage_note,
+    warm_wine,
+)
+
+# Results are saved into this subfolder of the input by default
+OUTPUT_FOLDER = "nik"
+
+
+def resolve_prog(value: str) -> Tuple[str, Path]:
+    """Program by index (as listed) or by case-insensitive name fragment"""
+
+    progs = discover_progs()
+    return progs[find_prog(value, progs)]
+
+
+def run_files(
+    prog: Tuple[str, Path],
+    inputs: List[Path],
+    output_dir: Optional[Path],
+    timeout: int = 0,
+) -> Tuple[Optional[Path], float]:
+    """Run the program on copies of the input files
+    Returns:
+        Path of the saved result or None if the program didn't change anything
+        Time spent in the program
+    """
+
+    prog_name, prog_filepath = prog
+    sizes = [path.stat().st_size for path in inputs]
+    # the result is about as large as an input
+    estimated_size = sum(sizes) + max(sizes)
+    with Workspace(estimated_size) as workspace:
+        temp_files: List[str] = []
+        for i, path in enumerate(inputs):
+            temp_path = str(workspace / f"tmpNik_{i}{path.suffix.lower()}")
+            shutil.copyfile(path, temp_path)
+            temp_files.append(temp_path)
+
+        with ResultWatcher(prog_name, temp_files) as watcher:
+            cmd = build_command(prog_filepath, temp_files)
+            env = get_program_env(prog_filepath)
+            elapsed = run_program(cmd, timeout, watcher=watcher, env=env)
+            if not (result_path := watcher.collect()):
+                return None, elapsed
+
+        out_dir = output_dir or inputs[0].parent / OUTPUT_FOLDER
+        out_dir.mkdir(parents=True, exist_ok=True)
+        out_path = out_dir / inputs[0].name
+        # the file itself if the result links to it, e.g. HDR Efex output (see adopt_file())
+        shutil.move(Path(result_path).resolve(), out_path)
+        return out_path, elapsed
+
+
+def cmd_list(_args: argparse.Namespace) -> int:
+    for idx, (prog_name, prog_filepath) in enumerate(discover_progs()):
+        print(f"{idx:>3}  {prog_name:<24} {prog_filepath}")
+    return 0
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    prog = resolve_prog(args.prog)
+    inputs = [Path(file) for file in args.files]
+    # hdr program merges all inputs, other programs work on one file at a time
+    batches = [inputs] if is_hdr_prog(prog[0]) else [[path] for path in inputs]
+    warm_wine(prog[1])
+
+    failed = 0
+    for batch in batches:
+        try:
+            before = child_usage()
+            result, elapsed = run_files(prog, batch, args.output, args.timeout)
+            usage = usage_note(before)
+            print(f"{batch[0]}: {result or 'no changes'} ({elapsed:.1f}s{usage})")
+        except (OSError, subprocess.SubprocessError) as error:
+            failed += 1
+            print(f"{batch[0]}: failed: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_report(args: argparse.Namespace) -> int:
+    if not (path := args.trace or get_trace_path()):
+        raise ValueError("Tracing is disabled, set TRACE_FILENAME or pass a trace file")
+    if not path.is_file():
+        raise ValueError(f"Trace not found: {path}")
+
+    summary = summarize_traces(load_traces(path))
+    print(
+        f"{'program / stage':<28} {'n':>5} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    )
+    for prog_name, stages in sorted(summary.items()):
+        print(prog_name)
+        for stage, values in stages.items():
+            cols = [percentile(values, p) for p in (50, 90, 99)] + [max(values)]
+            print(
+                f"  {stage:<26} {len(values):>5} "
+                + " ".join(f"{value:>7.2f}s" for value in cols)
+            )
+    return 0
+
+
+def cmd_cache(args: argparse.Namespace) -> int:
+    if not (cache := ResultCache.create()):
+        raise ValueError("Result cache is disabled, set RESULT_CACHE_MB in nikcore.py")
+
+    entries = cache.entries()
+    if args.clear:
+        for _, _, path in entries:
+            path.unlink(missing_ok=True)
+        print(f"Removed {len(entries)} cached result(s) from {cache.root}")
+        return 0
+
+    used = sum(size for _, size, _ in entries) / 2**20
+    budget = cache.budget / 2**20
+    print(f"{cache.root}: {len(entries)} result(s), {used:.1f} of {budget:.0f} MiB")
+    stats = cache.stats()
+    lookups = stats.get("hits", 0) + stats.get("misses", 0)
+    ratio = f" ({stats.get('hits', 0) / lookups:.0%} hit rate)" if lookups else ""
+    names = ("hits", "misses", "stores", "evictions")
+    print(", ".join(f"{name}: {stats.get(name, 0)}" for name in names) + ratio)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List installed Nik programs")
+    list_parser.set_defaults(func=cmd_list)
+
+    run_parser = subparsers.add_parser("run", help="Run a Nik program on image files")
+    run_parser.add_argument(
+        "-p", "--prog", required=True, help="Program index (see 'list') or name"
+    )
+    run_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help=f"Output folder (default: <input>/{OUTPUT_FOLDER})",
+    )
+    run_parser.add_argument(
+        "-t",
+        "--timeout",
+        type=int,
+        default=NIK_TIMEOUT,
+        help="Stop the program after this many seconds (default: %(default)s, 0: never)",
+    )
+    run_parser.add_argument("files", nargs="+", help="Image files to process")
+    run_parser.set_defaults(func=cmd_run)
+
+    report_parser = subparsers.add_parser(
+        "report", help="Summarize traced stage timings per program"
+    )
+    report_parser.add_argument(
+        "trace",
+        nargs="?",
+        type=Path,
+        help="Trace file (default: TRACE_FILENAME in the GIMP config folder)",
+    )
+    report_parser.set_defaults(func=cmd_report)
+
+    cache_parser = subparsers.add_parser("cache", help="Show the result cache usage")
+    cache_parser.add_argument(
+        "--clear", action="store_true", help="Remove all cached results"
+    )
+    cache_parser.set_defaults(func=cmd_cache)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except ValueError as error:
+        parser.error(str(error))
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
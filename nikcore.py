@@ -0,0 +1,1605 @@
+#!/usr/bin/env python3
+
+"""
+Core of the Nik Collection plugin independent of GIMP:
+program discovery, intermediate formats, workspaces, command building and result detection.
+Used by the GIMP plugin `nikplugin.py` and the command-line driver `nikcli.py`.
+
+LICENSE:
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+This program is licensed under the GNU General Public License v3 (GPLv3).
+
+CONTRIBUTING:
+For bug fixes & updates: https://iiey.github.io/nikgimp
+Issues and contributing: https://github.com/iiey/nikgimp
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import json
+import os
+import signal
+import struct
+import sys
+import time
+
+# NOTE: ctypes, hashlib, shutil, subprocess, tempfile and threading are imported where needed,
+# the plugin registration only needs the program discovery
+
+# NOTE: Specify IF your installation is not in the default location
+# e.g. D:/plugins/nikcollection
+NIK_BASE_PATH: str = ""
+
+# Discovery index stored under the GIMP config dir, set empty to disable
+CACHE_FILENAME: str = "nikplugin.json"
+CACHE_VERSION: int = 1
+# Folders where HDR Efex saves its output, probed before the defaults of get_hdr_output_dirs()
+# e.g. ("/mnt/home/me/Documents",), folders it was found in are remembered in the index
+HDR_OUTPUT_DIRS: Tuple[str, ...] = ()
+
+# NOTE: Specify a RAM-backed folder (tmpfs, ramdisk) for intermediate files
+# e.g. /mnt/ramdisk, '/dev/shm' is used automatically under linux
+NIK_TEMP_PATH: str = ""
+# Leftovers of crashed runs older than this (seconds) are removed
+STALE_WORKSPACE_AGE: int = 24 * 3600
+# Memory (bytes) left to GIMP and the program when checking if a run fits, see plan_export()
+MEMORY_RESERVE: int = 1024**3
+
+# Stop a program still running after this many seconds, 0 waits forever
+NIK_TIMEOUT: int = 0
+# Interval (seconds) between progress updates while a program is running
+POLL_INTERVAL: float = 0.1
+# Time (seconds) a stopped program gets to exit before it is killed
+KILL_GRACE: float = 3.0
+
+# Scheduling of the launched program, it applies from launch on (children included)
+# Niceness added to the program's, e.g. 10 to leave the CPUs to GIMP first, 0 keeps it
+# under Windows any positive value starts it with below normal priority
+# NOTE: not under macOS, the application is started by 'open' and isn't its child
+NIK_NICE: int = 0
+# Linux: I/O priority 'idle' or 'best-effort:<0-7>' (7 lowest), empty keeps the default
+NIK_IONICE: str = ""
+# Linux: CPUs the program may run on, e.g. "0-3,6", empty for all
+NIK_CPUS: str = ""
+# Linux: run it in a transient systemd scope with these limits (needs systemd-run --user)
+# e.g. ("CPUQuota=400%", "MemoryMax=8G"), empty for none
+NIK_SCOPE_PROPERTIES: Tuple[str, ...] = ()
+
+# Linux: keep a wineserver running this many seconds after the last program exited,
+# so following launches skip the Wine prefix boot, 0 disables the warm mode
+WINE_WARM_SECONDS: int = 0
+# Linux: read the program's DLLs ahead so they are in the page cache when Wine loads them
+WINE_PRELOAD_DLLS: bool = False
+
+# GIMP plugin: one plugin process started with GIMP serves all runs, the menu entries hand
+# their runs over to it, which skips the GEGL/GTK, discovery and dialog setup of each run
+# NOTE: GIMP registers the change only once nikplugin.py is newer (touch it)
+RESIDENT_MODE: bool = False
+# The resident exits after this many idle seconds and the next run starts it again,
+# 0 keeps it until GIMP quits
+RESIDENT_IDLE_SECONDS: int = 600
+
+# GIMP plugin: encode TIFF/PNG intermediates and decode uncompressed TIFF results in the
+# plugin (nikimage.py) from and into the layer buffers, False goes through GIMP's file plug-ins
+BUILTIN_CODECS: bool = True
+
+# Programs given all selected layers in one launch (layer source 'selected layers'),
+# by lowercase name fragment, they must save each opened file over itself
+# e.g. ("color efex", "viveza"), other programs get one launch per layer
+MULTI_FILE_PROGS: Tuple[str, ...] = ()
+
+# GIMP plugin: write only the tiles of the layer the program changed, instead of all of it,
+# undo memory and import time then follow the edited area, e.g. a few control points
+WRITE_CHANGED_TILES: bool = False
+
+# Without close-write events, a file is complete once unchanged for SETTLE_TIME (seconds)
+SETTLE_TIME: float = 0.5
+# Longest wait (seconds) for written files to complete after the program exited
+SETTLE_TIMEOUT: float = 10.0
+HASH_CHUNK_SIZE: int = 1024 * 1024
+
+# Keep the results of runs to reapply them to identical input without launching the program
+# Disk budget in MiB of the least recently used results, 0 disables the cache
+RESULT_CACHE_MB: int = 0
+# NOTE: Specify a folder for cached results, default is the user's cache folder
+# e.g. ~/.cache/nikgimp under linux
+RESULT_CACHE_PATH: str = ""
+
+# Append the duration of each stage of a run as a JSON line to this file
+# under the GIMP config dir (or an absolute path), empty disables tracing
+# e.g. "nikplugin-trace.jsonl", summarize with: python3 nikcli.py report
+TRACE_FILENAME: str = ""
+
+
+def print_alert(text: str, message: str) -> None:
+    """Default alert: report on stderr, the GIMP plugin shows a dialog instead"""
+
+    print(f"{text}\n{message}", file=sys.stderr)
+
+
+# Called to report problems to the user, replaced by the GIMP plugin
+alert: Callable[[str, str], None] = print_alert
+
+
+def get_config_dir() -> Path:
+    """GIMP user config folder, where the plugin keeps its files"""
+
+    if env_dir := os.environ.get("GIMP3_DIRECTORY"):
+        return Path(env_dir)
+    if sys.platform == "win32":
+        return Path(os.environ.get("APPDATA", Path.home())) / "GIMP/3.0"
+    if sys.platform == "darwin":
+        return Path.home() / "Library/Application Support/GIMP/3.0"
+    config_home = os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config")
+    return Path(config_home) / "GIMP/3.0"
+
+
+def get_search_paths() -> List[Path]:
+    """Base folders where Nik Collection is commonly installed"""
+
+    possible_paths = []
+    # Common installation paths
+    if sys.platform == "win32":
+        possible_paths = [
+            Path("C:/Program Files/DxO"),
+            Path("C:/Program Files/Google"),
+            Path("C:/Program Files (x86)/Google"),
+        ]
+    elif sys.platform == "darwin":
+        possible_paths = [
+            Path("/Applications"),
+            Path("~/Applications"),
+        ]
+    elif sys.platform.startswith("linux"):
+        possible_paths = [
+            Path.home() / ".wine/drive_c/Program Files/DxO",
+            Path.home() / ".wine/drive_c/Program Files/Google",
+        ]
+    return possible_paths
+
+
+def find_nik_install() -> Optional[Path]:
+    """Detect Nik Collection installation path based on operating system"""
+
+    possible_paths = get_search_paths()
+
+    # Search for all Nik Collection* folders under each base path
+    nik_folders = []
+    for base in possible_paths:
+        if base.is_dir():
+            nik_folders.extend(sorted(base.glob("Nik Collection*"), reverse=True))
+
+    for nik in nik_folders:
+        # DxO: check subfolder e.g. 'Nik Collection 8/bin'
+        if (nik_bin := nik / "bin").is_dir():
+            # stop at highest version (first in sorted list)
+            return nik_bin
+        # Google: check program subfolders (.app are folder in macOS too)
+        if any(d.is_dir() for d in nik.iterdir()):
+            return nik
+
+    # Fallback to user-configured path if specified
+    if NIK_BASE_PATH and (nik_path := Path(NIK_BASE_PATH)).is_dir():
+        return nik_path
+
+    alert(
+        text="Nik Collection installation path not found",
+        message=(
+            "Please specify the correct installation path in nikcore.py.\n"
+            f"{NIK_BASE_PATH=}"
+        ),
+    )
+
+    return None
+
+
+def list_mac_progs(base_path: Path) -> List[Tuple[str, Path]]:
+    """Function for both Google & DxO version (under macOS)
+    i.e.: /Applications/Nik Collection/program_name.app
+    """
+
+    mac_progs: List[Tuple[str, Path]] = []
+    for prog_item in base_path.iterdir():
+        if prog_item.is_dir() and prog_item.suffix == ".app":
+            mac_progs.append((prog_item.stem, prog_item))
+    return mac_progs
+
+
+def list_dxo_progs(base_path: Path) -> List[Tuple[str, Path]]:
+    """Function for DxO version (under windows)
+    i.e.: ../DxO/Nik Collection N/bin/program_name.exe
+    """
+
+    if "bin" not in base_path.name:
+        return []
+
+    dxo_progs: List[Tuple[str, Path]] = []
+    for prog_item in base_path.iterdir():
+        if (
+            prog_item.is_file()
+            and "nik" in prog_item.name.lower()
+            and prog_item.suffix == ".exe"
+        ):
+            dxo_progs.append((prog_item.stem, prog_item))
+    return dxo_progs
+
+
+def list_google_progs(base_path: Path) -> List[Tuple[str, Path]]:
+    """
+    Function for Google version (under windows)
+    There could be 64-bit folder (favoured) in program folder under `base_path`
+    Returns:
+        List of (prog_name, exec_path)
+    """
+
+    def get_prog_details(prog_dir: Path) -> Optional[Tuple[str, Path]]:
+        exec_file = None
+        bit64_dirs = [
+            d for d in prog_dir.iterdir() if d.is_dir() and "64-bit" in d.name.lower()
+        ]
+        # prefer 64-bit version
+        if bit64_dirs:
+            exec_file = next(bit64_dirs[0].glob("*.exe"), None)
+        # fallback default binary
+        if exec_file is None:
+            exec_file = next(prog_dir.glob("*.exe"), None)
+        # return one of above
+        return (prog_dir.name, exec_file) if exec_file else None
+
+    progs: List[Tuple[str, Path]] = []
+    sub_dirs = [d for d in base_path.iterdir() if d.is_dir()]
+
+    for prog_dir in sub_dirs:
+        if prog_detail := get_prog_details(prog_dir):
+            progs.append(prog_detail)
+
+    return progs
+
+
+def scan_progs(base_path: Path) -> List[Tuple[str, Path]]:
+    """Walk the installation folder and collect (prog_name, exec_path) sorted by name"""
+
+    progs_lst: List[Tuple[str, Path]] = []
+    # on mac, programs located directly under installation folder
+    if sys.platform == "darwin":
+        progs_lst.extend(list_mac_progs(base_path))
+    # on win or linx+wine
+    else:
+        progs_lst.extend(list_dxo_progs(base_path))
+        progs_lst.extend(list_google_progs(base_path))
+
+    progs_lst.sort(key=lambda x: x[0].lower())  # sort alphabetically
+    return progs_lst
+
+
+def get_cache_path(config_dir: Optional[Path] = None) -> Optional[Path]:
+    """Location of the persisted discovery index"""
+
+    if not CACHE_FILENAME:
+        return None
+    return (config_dir or get_config_dir()) / CACHE_FILENAME
+
+
+def get_trace_path(config_dir: Optional[Path] = None) -> Optional[Path]:
+    """Location of the timing trace, None if tracing is disabled"""
+
+    if not TRACE_FILENAME:
+        return None
+    return (config_dir or get_config_dir()) / TRACE_FILENAME
+
+
+def dir_stamps(paths: List[Path]) -> Dict[str, Optional[float]]:
+    """Modification times of the given folders, None for missing ones
+    Adding or removing an installation changes the mtime of its parent folder
+    """
+
+    stamps: Dict[str, Optional[float]] = {}
+    for path in paths:
+        try:
+            stamps[str(path)] = path.stat().st_mtime
+        except OSError:
+            stamps[str(path)] = None
+    return stamps
+
+
+def stamp_paths(install_path: Optional[Path]) -> List[Path]:
+    """Folders whose mtimes key the discovery index"""
+
+    paths = get_search_paths()
+    if NIK_BASE_PATH:
+        paths.append(Path(NIK_BASE_PATH))
+    if install_path:
+        paths.append(install_path)
+    return paths
+
+
+def read_index(config_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Content of the discovery index, empty if it is missing or unreadable"""
+
+    if not (cache_path := get_cache_path(config_dir)):
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_index(data: Dict[str, Any], config_dir: Optional[Path] = None) -> None:
+    """Replace the discovery index, failures only cost a rescan next time"""
+
+    if not (cache_path := get_cache_path(config_dir)):
+        return
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def load_cached_progs(
+    config_dir: Optional[Path] = None,
+) -> Optional[List[Tuple[str, Path]]]:
+    """Read the discovery index, None if it is missing or out of date"""
+
+    data = read_index(config_dir)
+    try:
+        if data.get("version") != CACHE_VERSION:
+            return None
+        install_path = Path(data["install"])
+        if data["stamps"] != dir_stamps(stamp_paths(install_path)):
+            return None
+        return [(name, Path(path)) for name, path in data["progs"]]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def save_cached_progs(
+    install_path: Path,
+    progs: List[Tuple[str, Path]],
+    config_dir: Optional[Path] = None,
+) -> None:
+    """Persist the discovery index, failures only cost a rescan next time"""
+
+    data = {
+        "version": CACHE_VERSION,
+        "install": str(install_path),
+        "stamps": dir_stamps(stamp_paths(install_path)),
+        "progs": [[name, str(path)] for name, path in progs],
+        # survives rescans, see remember_hdr_output_dir()
+        "hdr_output_dirs": read_index(config_dir).get("hdr_output_dirs", []),
+    }
+    write_index(data, config_dir)
+
+
+# Programs resolved once per process, see discover_progs()
+_PROGS: Optional[List[Tuple[str, Path]]] = None
+
+
+def discover_progs(config_dir: Optional[Path] = None) -> List[Tuple[str, Path]]:
+    """Installed Nik programs from memory, the discovery index or a fresh scan"""
+
+    global _PROGS  # pylint: disable=W0603
+    if _PROGS is not None:
+        return _PROGS
+
+    if (progs := load_cached_progs(config_dir)) is None:
+        if not (base_path := find_nik_install()):
+            return []
+        progs = scan_progs(base_path)
+        save_cached_progs(base_path, progs, config_dir)
+
+    _PROGS = progs
+    return _PROGS
+
+
+def list_progs(
+    idx: Optional[int] = None,
+    config_dir: Optional[Path] = None,
+) -> Union[List[str], Tuple[str, Path]]:
+    """
+    Build a list of Nik programs installed on the system
+    Args:
+        idx: Optional index of the program to return details for
+        config_dir: Folder of the discovery index, default GIMP config folder
+    Returns:
+        If idx is None, returns a list of program names
+        Otherwise, returns [prog_name, prog_filepath] for the specified program
+    """
+
+    progs_lst = discover_progs(config_dir)
+
+    if idx is None:
+        return [prog[0] for prog in progs_lst]
+    if 0 <= idx < len(progs_lst):
+        return progs_lst[idx]
+    return []  # invalid index
+
+
+def find_prog(value: str, progs: List[Tuple[str, Path]]) -> int:
+    """Index of a program given by index (as listed) or by case-insensitive name fragment"""
+
+    value = value.strip()
+    if value.isdigit() and int(value) < len(progs):
+        return int(value)
+    matches = [
+        idx for idx, prog in enumerate(progs) if value.lower() in prog[0].lower()
+    ]
+    if len(matches) != 1:
+        names = ", ".join(progs[idx][0] for idx in matches) or "none"
+        raise ValueError(
+            f"Program '{value}' is ambiguous or unknown (matches: {names})"
+        )
+    return matches[0]
+
+
+def get_preferred_hdr_dirs(config_dir: Optional[Path] = None) -> List[Path]:
+    """Existing folders of HDR_OUTPUT_DIRS and where the output was found before"""
+
+    remembered = read_index(config_dir).get("hdr_output_dirs", [])
+    paths = [Path(path) for path in (*HDR_OUTPUT_DIRS, *remembered)]
+    preferred: List[Path] = []
+    for path in paths:
+        if path.is_dir() and (path := path.resolve()) not in preferred:
+            preferred.append(path)
+    return preferred
+
+
+def remember_hdr_output_dir(path: Path, config_dir: Optional[Path] = None) -> None:
+    """Keep the folder HDR Efex saved to first in the index, along with the last others"""
+
+    data = read_index(config_dir)
+    if not data:
+        return
+    others = [p for p in data.get("hdr_output_dirs", []) if p != str(path)]
+    if (dirs := [str(path)] + others[:2]) != data.get("hdr_output_dirs"):
+        data["hdr_output_dirs"] = dirs
+        write_index(data, config_dir)
+
+
+def get_hdr_output_dirs() -> List[Path]:
+    """
+    Existing folders where HDR Efex may save its output based on OS
+    It typically extends original input file with '_HDR' and stores under the Documents folder
+    """
+
+    # NOTE: extend paths correspondingly if you custom your documents folder
+    candidate_paths: List[Path] = []
+    if sys.platform in "win32":
+        candidate_paths = [
+            Path.home() / "Documents",
+            Path("D:/Documents"),
+        ]
+    if sys.platform == "darwin":
+        # NOTE: extend to where intermediate files are stored
+        candidate_paths = [
+            Path.home(),
+            Path.home() / "Documents",
+            Path.home() / "Pictures",
+        ]
+    elif sys.platform.startswith("linux"):
+        wine_user = os.environ.get("USER", os.environ.get("USERNAME", "user"))
+        candidate_paths = [
+            Path.home() / f".wine/drive_c/users/{wine_user}/My Documents",
+        ]
+
+    return [p.resolve() for p in candidate_paths if p.is_dir()]
+
+
+def hdr_output_name(input_path: Path) -> str:
+    """File name HDR Efex gives to the result of the given input"""
+
+    return f"{input_path.stem}_HDR{input_path.suffix}"
+
+
+def is_hdr_prog(prog_name: str) -> bool:
+    """HDR Efex merges several input files and saves its output elsewhere"""
+
+    return "hdr efex pro" in prog_name.lower()
+
+
+def accepts_multiple_files(prog_name: str) -> bool:
+    """The program opens several files in one launch and saves each over its input"""
+
+    name = prog_name.lower()
+    return not is_hdr_prog(prog_name) and any(key in name for key in MULTI_FILE_PROGS)
+
+
+def build_command(prog_filepath: Path, files: List[str]) -> List[str]:
+    """Command line calling the program with the given files"""
+
+    if sys.platform == "darwin":
+        prog_caller = ["open", "-W", "-a"]
+    elif sys.platform == "linux":
+        prog_caller = ["wine"]
+    else:  # windows
+        prog_caller = []
+    return prog_caller + [str(prog_filepath)] + files
+
+
+def find_wine_prefix(prog_filepath: Path) -> Optional[Path]:
+    """Wine prefix (folder containing 'drive_c') the program is installed in"""
+
+    for parent in prog_filepath.parents:
+        if parent.name == "drive_c":
+            return parent.parent
+    return None
+
+
+def get_program_env(prog_filepath: Path) -> Optional[Dict[str, str]]:
+    """Environment to launch the program with, None to inherit the current one"""
+
+    if sys.platform != "linux" or not (prefix := find_wine_prefix(prog_filepath)):
+        return None
+    return {**os.environ, "WINEPREFIX": str(prefix)}
+
+
+def preload_files(paths: List[Path]) -> None:
+    """Read files once to have them in the page cache"""
+
+    for path in paths:
+        try:
+            with open(path, "rb") as file:
+                while file.read(HASH_CHUNK_SIZE):
+                    pass
+        except OSError:
+            continue
+
+
+def warm_wine(prog_filepath: Path) -> None:
+    """
+    Start a persistent wineserver for the program's prefix if warm mode is enabled
+    It exits by itself WINE_WARM_SECONDS after the last Wine program, and is reused by
+    all launches meanwhile. Nothing happens if a wineserver is already up for the prefix.
+    """
+
+    if sys.platform != "linux" or WINE_WARM_SECONDS <= 0:
+        return
+    import subprocess
+    import threading
+
+    try:
+        # wineserver detaches itself, the call returns immediately
+        subprocess.run(
+            ["wineserver", f"--persistent={WINE_WARM_SECONDS}"],
+            env=get_program_env(prog_filepath),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10,
+            check=False,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return
+
+    if WINE_PRELOAD_DLLS:
+        files = [prog_filepath, *prog_filepath.parent.glob("*.dll")]
+        threading.Thread(target=preload_files, args=(files,), daemon=True).start()
+
+
+class Cancelled(Exception):
+    """The user cancelled while a program was running"""
+
+
+class InsufficientResources(Exception):
+    """A run wouldn't fit into memory or temp space, raised before anything is exported"""
+
+
+def scheduling_prefix() -> List[str]:
+    """
+    Commands starting the program with the configured scheduling (NIK_NICE and below),
+    each one execs the next, so the program keeps the pid and all applies from launch on
+    Tools that aren't installed are skipped with a warning
+    """
+
+    import shutil
+
+    is_linux = sys.platform.startswith("linux")
+    wanted: List[List[str]] = []
+    if is_linux and NIK_SCOPE_PROPERTIES:
+        wanted.append(
+            ["systemd-run", "--user", "--scope", "--quiet", "--collect"]
+            + [f"--property={prop}" for prop in NIK_SCOPE_PROPERTIES]
+        )
+    if is_linux and NIK_CPUS:
+        wanted.append(["taskset", "--cpu-list", NIK_CPUS])
+    if is_linux and NIK_IONICE:
+        kind, _, level = NIK_IONICE.partition(":")
+        if kind not in ("idle", "best-effort"):
+            raise ValueError(f"Invalid NIK_IONICE: {NIK_IONICE}")
+        wanted.append(
+            ["ionice", "-c", "3" if kind == "idle" else "2"]
+            + (["-n", level] if level else [])
+        )
+    if NIK_NICE:
+        wanted.append(["nice", "-n", str(NIK_NICE)])
+
+    prefix = []
+    for cmd in wanted:
+        if shutil.which(cmd[0]):
+            prefix += cmd
+        else:
+            print(f"{cmd[0]} not found, started without it", file=sys.stderr)
+    return prefix
+
+
+def parent_death_signal() -> Optional[Callable[[], None]]:
+    """
+    Linux: function run by the launched process before exec, it gets SIGTERM once the
+    launching thread exits e.g. GIMP killed the plugin, None elsewhere
+    The signal survives exec and the scheduling prefix, but not the program's own children
+    """
+
+    if not sys.platform.startswith("linux"):
+        return None
+    import ctypes
+
+    pr_set_pdeathsig = 1
+    # resolved here, the child between fork and exec shouldn't load anything
+    prctl = ctypes.CDLL(None, use_errno=True).prctl
+    parent = os.getpid()
+
+    def set_signal() -> None:
+        prctl(pr_set_pdeathsig, signal.SIGTERM)
+        if os.getppid() != parent:
+            # the plugin died before the signal was set
+            os._exit(1)
+
+    return set_signal
+
+
+def launch(cmd: List[str], env: Optional[Dict[str, str]] = None) -> "subprocess.Popen":
+    """Start the program without blocking, with the configured scheduling
+    It gets its own process group so it can be stopped with all its children (e.g. wine),
+    under Linux it's stopped as well if the plugin dies, see parent_death_signal()
+    """
+
+    import subprocess
+
+    if sys.platform == "win32":
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP
+        if NIK_NICE > 0:
+            flags |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        return subprocess.Popen(cmd, env=env, creationflags=flags)
+    # the preexec hook only calls prctl(), nothing another thread could hold a lock of
+    return subprocess.Popen(  # pylint: disable=W1509
+        scheduling_prefix() + cmd,
+        env=env,
+        start_new_session=True,
+        preexec_fn=parent_death_signal(),
+    )
+
+
+def terminate(proc: "subprocess.Popen") -> None:
+    """Stop the program and its children, kill them if they don't exit in time"""
+
+    import subprocess
+
+    if proc.poll() is not None:
+        return
+    if sys.platform == "win32":
+        subprocess.call(
+            ["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    else:
+        # NOTE: under macOS this stops 'open' only, not the application itself
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    proc.wait()
+
+
+def wait_program(
+    proc: "subprocess.Popen",
+    timeout: float = 0,
+    on_tick: Optional[Callable[[float], bool]] = None,
+    watcher: Optional["ResultWatcher"] = None,
+) -> float:
+    """
+    Wait for a launched program, calling on_tick(elapsed) every POLL_INTERVAL
+    Args:
+        timeout: Wall-clock limit in seconds, 0 for none
+        on_tick: Progress callback, returning False cancels the program
+        watcher: Records the files written meanwhile
+    Returns:
+        Elapsed time in seconds
+    Raises:
+        Cancelled, subprocess.TimeoutExpired, subprocess.CalledProcessError
+    """
+
+    import subprocess
+
+    start = time.monotonic()
+    while True:
+        try:
+            returncode: Optional[int] = proc.wait(POLL_INTERVAL)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        elapsed = time.monotonic() - start
+        if watcher:
+            watcher.poll()
+        if returncode is not None:
+            break
+        if timeout and elapsed > timeout:
+            terminate(proc)
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        if on_tick and not on_tick(elapsed):
+            terminate(proc)
+            raise Cancelled(f"Cancelled after {elapsed:.1f}s")
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, proc.args)
+    return elapsed
+
+
+def run_program(
+    cmd: List[str],
+    timeout: float = 0,
+    on_tick: Optional[Callable[[float], bool]] = None,
+    watcher: Optional["ResultWatcher"] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> float:
+    """Run the program to completion, see wait_program()"""
+
+    proc = launch(cmd, env)
+    try:
+        return wait_program(proc, timeout, on_tick, watcher)
+    finally:
+        terminate(proc)
+
+
+def child_usage() -> Optional[Tuple[float, int]]:
+    """CPU seconds of all finished child processes and the peak RSS (KiB) of the largest one
+    None under Windows
+    """
+
+    if sys.platform == "win32":
+        return None
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # macOS reports bytes, linux KiB
+    peak = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return usage.ru_utime + usage.ru_stime, peak
+
+
+def usage_note(before: Optional[Tuple[float, int]]) -> str:
+    """CPU time and peak memory of the children finished since child_usage() gave before,
+    e.g. ', cpu 41.2s, peak 812 MiB', empty if unknown
+    The peak is the largest child's so far, a new maximum is the last program's
+    """
+
+    if not before or not (after := child_usage()):
+        return ""
+    return f", cpu {after[0] - before[0]:.1f}s, peak {after[1] // 1024} MiB"
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started, in steps of a clock tick
+    None if unknown (only Linux)
+    """
+
+    try:
+        with open("/proc/self/stat", encoding="ascii") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="ascii") as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    # starttime is field 22 of stat, the 20th after the command name
+    return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+
+
+class Trace:
+    """Time the stages of a run and append them as one record to the trace file
+    Without a path every call returns right away, so it can stay in place when disabled
+    NOTE: under macOS the program isn't a child of 'open', its CPU time isn't counted
+    """
+
+    def __init__(self, path: Optional[Path], **info: Any) -> None:
+        self.path = path
+        self.start = time.perf_counter()
+        self.record: Dict[str, Any] = {"time": round(time.time(), 3), **info}
+        self.stages: Dict[str, float] = {}
+
+    def set(self, **info: Any) -> None:
+        if self.path:
+            self.record.update(info)
+
+    @contextmanager
+    def stage(self, name: str, child: bool = False) -> Iterator[None]:
+        """Time the enclosed block, with child=True also the CPU and memory of the program run"""
+
+        if not self.path:
+            yield
+            return
+        before = child_usage() if child else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = round(self.stages.get(name, 0.0) + elapsed, 4)
+            if before and (after := child_usage()):
+                cpu = self.record.get("child_cpu", 0.0) + after[0] - before[0]
+                self.record["child_cpu"] = round(cpu, 3)
+                # the peak of all children so far, a new maximum is this program's
+                self.record["child_peak_rss_kb"] = after[1]
+
+    def add(self, name: str, elapsed: Optional[float]) -> None:
+        """Stage timed elsewhere, e.g. before the trace existed, None if unknown"""
+
+        if self.path and elapsed is not None:
+            self.stages[name] = round(self.stages.get(name, 0.0) + elapsed, 4)
+
+    def save(self, status: str) -> None:
+        """Append the record, a failing trace never fails the run"""
+
+        if not self.path:
+            return
+        self.record.update(
+            status=status,
+            total=round(time.perf_counter() - self.start, 4),
+            stages=self.stages,
+        )
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(self.record) + "\n")
+        except OSError as error:
+            print(f"Cannot write trace {self.path}: {error}", file=sys.stderr)
+
+
+def load_traces(path: Path) -> List[Dict[str, Any]]:
+    """Records of the trace file, malformed lines are skipped"""
+
+    records = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of the values"""
+
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize_traces(
+    records: List[Dict[str, Any]],
+) -> Dict[str, Dict[str, List[float]]]:
+    """Durations grouped by program and stage, the whole run is stage 'total'"""
+
+    summary: Dict[str, Dict[str, List[float]]] = {}
+    for record in records:
+        stages = summary.setdefault(str(record.get("prog", "?")), {})
+        for name, elapsed in record.get("stages", {}).items():
+            stages.setdefault(name, []).append(float(elapsed))
+        if "total" in record:
+            stages.setdefault("total", []).append(float(record["total"]))
+    return summary
+
+
+def file_digest(path: Path) -> Optional[str]:
+    """Fast content hash of a file, None if it doesn't exist"""
+
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def stat_key(path: Path) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, None if it doesn't exist"""
+
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Record writes to the given files while a program runs
+    This base version polls their stat and considers a write complete
+    when the file didn't change for SETTLE_TIME
+    """
+
+    def __init__(self, paths: List[Path]) -> None:
+        self.paths = paths
+        self.stats = {path: stat_key(path) for path in paths}
+        # path -> time of the last observed write, in order of the first write
+        self.changed: Dict[Path, float] = {}
+        self.complete: Set[Path] = set()
+
+    def mark(self, path: Path, complete: bool = False) -> None:
+        self.changed[path] = time.monotonic()
+        if complete:
+            self.complete.add(path)
+        else:
+            self.complete.discard(path)
+
+    def poll(self) -> None:
+        for path in self.paths:
+            if (key := stat_key(path)) != self.stats[path]:
+                self.stats[path] = key
+                self.mark(path)
+
+    def is_complete(self, path: Path) -> bool:
+        return (
+            path in self.complete
+            or time.monotonic() - self.changed[path] >= SETTLE_TIME
+        )
+
+    def wait_complete(self, timeout: float) -> None:
+        """Wait until all written files are complete, at most timeout seconds"""
+
+        deadline = time.monotonic() + timeout
+        self.poll()
+        while not all(map(self.is_complete, self.changed)):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+            self.poll()
+
+    def written(self) -> List[Path]:
+        """Written files, first written first"""
+
+        return list(self.changed)
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher(FileWatcher):
+    """Linux version reacting on inotify events of the files' folders,
+    a write is complete with the close-write (or moved-to) event
+    """
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths: List[Path]) -> None:
+        import ctypes
+
+        super().__init__(paths)
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        # watch descriptor -> folder
+        self.folders: Dict[int, Path] = {}
+        # events were lost, stat polling takes over
+        self.overflowed = False
+        for folder in {path.parent for path in paths}:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {folder}")
+            self.folders[wd] = folder
+
+    def poll(self) -> None:
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            buffer = b""
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+            # e.g. wd -1 of an overflow or a removed watch
+            if (folder := self.folders.get(wd)) is None:
+                continue
+            path = folder / os.fsdecode(name)
+            if path in self.stats:
+                self.mark(path, bool(mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO)))
+        if self.overflowed:
+            super().poll()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_watcher(paths: List[Path]) -> FileWatcher:
+    """inotify watcher under linux, polling watcher as fallback"""
+
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            pass
+    return FileWatcher(paths)
+
+
+def adopt_file(source: Path, target: Path) -> None:
+    """
+    Put source at target without copying: renamed on the same filesystem, otherwise
+    target becomes a link to it, removed along with the workspace (see Workspace)
+    Copied only if neither is possible
+    """
+
+    import shutil
+
+    try:
+        os.replace(source, target)
+        return
+    except OSError:
+        pass
+    try:
+        target.unlink(missing_ok=True)
+        target.symlink_to(source)
+    except OSError:
+        shutil.move(source, target)
+
+
+def remove_file(path: Path) -> None:
+    """Remove an intermediate file, a link along with the file it points to (see adopt_file())"""
+
+    if path.is_symlink():
+        path.resolve().unlink(missing_ok=True)
+    path.unlink(missing_ok=True)
+
+
+class ResultWatcher:  # pylint: disable=R0902
+    """Detect the processed image of a program run
+    Watches the intermediate file and, for HDR Efex, its expected output in the Documents folders
+    Changes are confirmed by content hash, rewriting identical bytes is no change
+    """
+
+    def __init__(
+        self,
+        prog_name: str,
+        temp_files: List[str],
+        each: bool = False,
+        config_dir: Optional[Path] = None,
+    ) -> None:
+        self.prog_name = prog_name
+        self.config_dir = config_dir
+        # where the program writes: a linked file (see adopt_file()) is watched in its folder
+        self.result_path = Path(temp_files[0]).resolve()
+        # with each, every input is a result of its own, see collect_each()
+        self.result_paths = [
+            Path(path).resolve() for path in temp_files[: None if each else 1]
+        ]
+        self.digests = {path: file_digest(path) for path in self.result_paths}
+        self.hdr_paths: List[Path] = []
+        # probed after the run only, if the output isn't in a watched folder
+        self.hdr_fallbacks: List[Path] = []
+        if is_hdr_prog(prog_name):
+            # handle troublesome hdr program, it doesn't save to the input file
+            # known folders are watched, the defaults only if there are none
+            preferred = get_preferred_hdr_dirs(config_dir)
+            defaults = [p for p in get_hdr_output_dirs() if p not in preferred]
+            if not preferred and not defaults:
+                alert(
+                    text=f"{prog_name}: Folder not found",
+                    message="Plugin cannot identify 'Documents' on your system.",
+                )
+            fname = hdr_output_name(self.result_path)
+            self.hdr_paths = [path / fname for path in preferred or defaults]
+            self.hdr_fallbacks = [path / fname for path in defaults if preferred]
+            for path in self.hdr_paths + self.hdr_fallbacks:
+                # left behind by an earlier run, it would pass for this run's output
+                path.unlink(missing_ok=True)
+        self.watcher = create_watcher(self.result_paths + self.hdr_paths)
+
+    def __enter__(self) -> "ResultWatcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def poll(self) -> None:
+        self.watcher.poll()
+
+    def close(self) -> None:
+        self.watcher.close()
+
+    def collect(self) -> Optional[str]:
+        """Location of the processed image or None if the program didn't change it"""
+
+        self.watcher.wait_complete(SETTLE_TIMEOUT)
+        written = self.watcher.written()
+
+        if self.hdr_paths:
+            written += [p for p in self.hdr_fallbacks if p.is_file()]
+            if not (
+                hdr_path := next((p for p in written if p in self.hdr_paths), None)
+                or next((p for p in written if p in self.hdr_fallbacks), None)
+            ):
+                fname = self.hdr_paths[0].name
+                alert(
+                    text=f"{self.prog_name}: File not found",
+                    message=f"Plugin cannot find the output {fname} in 'Documents'.",
+                )
+                return None
+            remember_hdr_output_dir(hdr_path.parent, self.config_dir)
+            # to the designed location, it's removed with the workspace
+            adopt_file(hdr_path, self.result_path)
+        elif self.result_path not in written:
+            return None
+
+        # Check if the file content was modified
+        if file_digest(self.result_path) == self.digests[self.result_path]:
+            return None
+        return str(self.result_path)
+
+    def collect_each(self) -> List[Optional[str]]:
+        """Per input file its location if the program changed it, else None"""
+
+        self.watcher.wait_complete(SETTLE_TIMEOUT)
+        written = self.watcher.written()
+        return [
+            (
+                str(path)
+                if path in written and file_digest(path) != self.digests[path]
+                else None
+            )
+            for path in self.result_paths
+        ]
+
+
+def is_pid_alive(pid: int) -> bool:
+    """Check whether a process exists, always assumed under windows"""
+
+    if sys.platform == "win32":
+        # os.kill() would terminate the process here
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def available_memory() -> Optional[int]:
+    """Bytes of memory available without swapping, None if unknown (only Linux)"""
+
+    try:
+        with open("/proc/meminfo", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def format_bytes(size: int) -> str:
+    return f"{size / 1024**3:.1f} GiB" if size >= 1024**3 else f"{size >> 20} MiB"
+
+
+class Workspace:
+    """Private folder for the intermediate files of one plugin run
+    It's created on a RAM-backed location if the estimated files fit there,
+    otherwise in the system temp folder and removed with all its content on exit
+    The estimated size covers the input files and Nik's result (see Footprint.disk)
+    """
+
+    PREFIX = "nikgimp-"
+
+    def __init__(self, estimated_size: int = 0) -> None:
+        self.estimated_size = estimated_size
+        self.path: Optional[Path] = None
+
+    @staticmethod
+    def get_roots() -> List[Path]:
+        """Candidate parent folders, preferred first"""
+
+        import tempfile
+
+        roots = []
+        if NIK_TEMP_PATH:
+            roots.append(Path(NIK_TEMP_PATH))
+        if sys.platform.startswith("linux"):
+            roots.append(Path("/dev/shm"))
+        roots.append(Path(tempfile.gettempdir()))
+        return [root for root in roots if root.is_dir() and os.access(root, os.W_OK)]
+
+    @staticmethod
+    def free_space(root: Path) -> int:
+        """Free bytes in root, in /dev/shm limited by the memory available beyond MEMORY_RESERVE"""
+
+        import shutil
+
+        try:
+            free = shutil.disk_usage(root).free
+        except OSError:
+            return 0
+        if root == Path("/dev/shm") and (memory := available_memory()) is not None:
+            free = min(free, memory - MEMORY_RESERVE)
+        return free
+
+    @classmethod
+    def room(cls) -> int:
+        """Free bytes of the roomiest root"""
+
+        return max((cls.free_space(root) for root in cls.get_roots()), default=0)
+
+    def select_root(self) -> Path:
+        """First root with room for the input files and Nik's result"""
+
+        roots = self.get_roots()
+        for root in roots[:-1]:
+            if self.free_space(root) > self.estimated_size:
+                return root
+        return roots[-1]
+
+    @classmethod
+    def remove_stale(cls, roots: List[Path]) -> None:
+        """Remove workspaces left behind by crashed or killed runs"""
+
+        import shutil
+
+        now = time.time()
+        for root in roots:
+            for path in root.glob(f"{cls.PREFIX}*"):
+                try:
+                    pid = int(path.name[len(cls.PREFIX) :].split("-")[0])
+                    is_old = now - path.stat().st_mtime > STALE_WORKSPACE_AGE
+                except (ValueError, OSError):
+                    continue
+                if pid != os.getpid() and (is_old or not is_pid_alive(pid)):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def __enter__(self) -> Path:
+        import tempfile
+
+        if self.path:
+            # entered ahead, e.g. to export while the dialog is open
+            return self.path
+        self.remove_stale(self.get_roots())
+        root = self.select_root()
+        self.path = Path(
+            tempfile.mkdtemp(prefix=f"{self.PREFIX}{os.getpid()}-", dir=root)
+        )
+        return self.path
+
+    def __exit__(self, *exc_info) -> None:
+        import shutil
+
+        if self.path:
+            # files adopted from elsewhere, see adopt_file()
+            for path in self.path.iterdir():
+                if path.is_symlink():
+                    remove_file(path)
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+def get_result_cache_dir() -> Path:
+    """Folder of the cached results, RESULT_CACHE_PATH or the per-user cache location"""
+
+    if RESULT_CACHE_PATH:
+        return Path(RESULT_CACHE_PATH)
+    if sys.platform == "win32":
+        return Path(os.environ.get("LOCALAPPDATA", Path.home())) / "nikgimp/cache"
+    if sys.platform == "darwin":
+        return Path.home() / "Library/Caches/nikgimp"
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "nikgimp"
+
+
+class ResultCache:
+    """
+    Content-addressed store of program results, bounded to a disk budget
+    The key hashes the intermediate files as handed over, the program path and the format.
+    Least recently used results (by mtime, bumped on every hit) are evicted first.
+    NOTE: settings chosen inside the Nik program aren't part of the key, reusing is on request
+    """
+
+    STATS_FILENAME = "stats.json"
+
+    def __init__(self, root: Path, budget: int) -> None:
+        self.root = root
+        self.budget = budget
+
+    @classmethod
+    def create(cls) -> Optional["ResultCache"]:
+        """The configured cache, None if it is disabled"""
+
+        if RESULT_CACHE_MB <= 0:
+            return None
+        return cls(get_result_cache_dir(), RESULT_CACHE_MB * 1024 * 1024)
+
+    @staticmethod
+    def key(files: List[str], prog_filepath: Path, fmt: str) -> str:
+        import hashlib
+
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(f"{prog_filepath}\0{fmt}\0{len(files)}".encode())
+        for path in files:
+            with open(path, "rb") as file:
+                while chunk := file.read(HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """Cached results (mtime, size, path), oldest first"""
+
+        entries = []
+        for path in self.root.glob("*.result*"):
+            try:
+                if path.suffix != ".tmp":
+                    entries.append((path.stat().st_mtime, path.stat().st_size, path))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def count(self, name: str, increment: int = 1) -> None:
+        """Add to a persisted counter (hits, misses, stores, evictions)"""
+
+        stats = self.stats()
+        stats[name] = stats.get(name, 0) + increment
+        tmp_path = self.root / f"{self.STATS_FILENAME}.{os.getpid()}.tmp"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(stats), encoding="utf-8")
+            os.replace(tmp_path, self.root / self.STATS_FILENAME)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            with open(self.root / self.STATS_FILENAME, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[Path]:
+        """Path of the cached result, None on a miss"""
+
+        for path in self.root.glob(f"{key}.result*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                os.utime(path)
+            except OSError:
+                continue
+            self.count("hits")
+            return path
+        self.count("misses")
+        return None
+
+    def put(self, key: str, result_path: str) -> None:
+        """Store a copy of the result and evict old ones beyond the budget"""
+
+        import shutil
+
+        size = Path(result_path).stat().st_size
+        if size > self.budget:
+            return
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            target = self.root / f"{key}.result{Path(result_path).suffix}"
+            tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+            shutil.copyfile(result_path, tmp_path)
+            os.replace(tmp_path, target)
+        except OSError as error:
+            print(f"Cannot cache result: {error}", file=sys.stderr)
+            return
+        self.count("stores")
+        self.evict()
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.budget:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self.count("evictions", evicted)
+
+
+class FileFormat(str, Enum):
+    AUTO = "auto"
+    TIFF = "tiff"
+    TIFF_LZW = "tiff_lzw"
+    PNG = "png"
+    JPEG = "jpeg"
+
+    @property
+    def suffix(self) -> str:
+        if self == FileFormat.AUTO:
+            raise ValueError("Resolve 'auto' to a format first")
+        return {
+            FileFormat.TIFF: ".tif",
+            FileFormat.TIFF_LZW: ".tif",
+            FileFormat.PNG: ".png",
+            FileFormat.JPEG: ".jpg",
+        }[self]
+
+    @property
+    def encoder(self) -> Optional[str]:
+        """Format name of the built-in encoder (nikimage)
+        None if there is none or BUILTIN_CODECS is off
+        """
+
+        if not BUILTIN_CODECS:
+            return None
+        return {FileFormat.TIFF: "tiff", FileFormat.PNG: "png"}.get(self)
+
+    @property
+    def size_ratio(self) -> float:
+        """Typical file size relative to the raw pixels, rather too large than too small"""
+
+        return {
+            FileFormat.TIFF_LZW: 0.8,
+            FileFormat.PNG: 0.8,
+            FileFormat.JPEG: 0.3,
+        }.get(self, 1.0)
+
+    @property
+    def export_proc(self) -> str:
+        return {
+            FileFormat.TIFF: "file-tiff-export",
+            FileFormat.TIFF_LZW: "file-tiff-export",
+            FileFormat.PNG: "file-png-export",
+            FileFormat.JPEG: "file-jpeg-export",
+        }[self]
+
+    @property
+    def label(self) -> str:
+        return {
+            FileFormat.AUTO: "auto",
+            FileFormat.TIFF: "TIFF",
+            FileFormat.TIFF_LZW: "TIFF (LZW)",
+            FileFormat.PNG: "PNG",
+            FileFormat.JPEG: "JPEG",
+        }[self]
+
+    @property
+    def help(self) -> str:
+        return {
+            FileFormat.AUTO: "Use the format registered for the program",
+            FileFormat.TIFF: "Lossless, uncompressed: fastest to encode and decode",
+            FileFormat.TIFF_LZW: "Lossless, smaller files at the cost of encoding time",
+            FileFormat.PNG: "Lossless, compressed with the given PNG level",
+            FileFormat.JPEG: "Lossy, compressed with the given JPEG quality",
+        }[self]
+
+
+# Intermediate format per program, matched by lowercase name fragment
+# similar to the 'ext' column of the former shellout.py
+PROG_FORMATS: Dict[str, FileFormat] = {
+    "analog efex": FileFormat.TIFF,
+    "color efex": FileFormat.TIFF,
+    "dfine": FileFormat.TIFF,
+    # NOTE: output must match 'Image Output Format' set in the program (see troubleshooting)
+    "hdr efex": FileFormat.JPEG,
+    "sharpener": FileFormat.TIFF,
+    "silver efex": FileFormat.TIFF,
+    "viveza": FileFormat.TIFF,
+}
+# Used for programs without an entry above
+DEFAULT_FORMAT = FileFormat.JPEG
+
+
+@dataclass(frozen=True)
+class ExportSettings:
+    """How intermediate files handed to Nik are encoded"""
+
+    fmt: FileFormat = FileFormat.AUTO
+    png_level: int = 1
+    jpeg_quality: int = 95
+    # encode each layer before reading the next, for several large layers (see plan_export())
+    streamed: bool = False
+
+    def resolve(self, prog_name: str) -> "ExportSettings":
+        """Replace 'auto' by the format registered for the given program"""
+
+        if self.fmt != FileFormat.AUTO:
+            return self
+        name = prog_name.lower()
+        fmt = next(
+            (f for key, f in PROG_FORMATS.items() if key in name), DEFAULT_FORMAT
+        )
+        return replace(self, fmt=fmt)
+
+
+@dataclass(frozen=True)
+class Footprint:
+    """Expected peak use of a run in bytes"""
+
+    # pixels held by the plugin while exporting
+    memory: int
+    # intermediate files and the program's result
+    disk: int
+
+
+def estimate_footprint(layer_sizes: List[int], settings: ExportSettings) -> Footprint:
+    """
+    Footprint of exporting layers with the given raw pixel sizes (bytes)
+    The built-in encoders hold all layers at once unless streamed, GIMP's export one at a time
+    """
+
+    largest = max(layer_sizes, default=0)
+    if settings.fmt.encoder and not settings.streamed:
+        memory = sum(layer_sizes) + largest
+    else:
+        memory = 2 * largest
+    ratio = settings.fmt.size_ratio
+    return Footprint(memory, int((sum(layer_sizes) + largest) * ratio))
+
+
+def plan_export(
+    layer_sizes: List[int], settings: ExportSettings
+) -> Tuple[ExportSettings, Footprint]:
+    """
+    Check a run fits into memory and temp space before anything is exported
+    Cheaper ways are taken if needed: streaming the layers one by one,
+    the roomiest temp location (see Workspace) and LZW instead of uncompressed TIFF
+    Args:
+        settings: resolved for the program (see ExportSettings.resolve())
+    Returns:
+        Settings to export with and the expected footprint
+    Raises:
+        InsufficientResources if there is no way
+    """
+
+    footprint = estimate_footprint(layer_sizes, settings)
+    if (memory := available_memory()) is not None:
+        budget = memory - MEMORY_RESERVE
+        if footprint.memory > budget and settings.fmt.encoder:
+            settings = replace(settings, streamed=True)
+            footprint = estimate_footprint(layer_sizes, settings)
+        if footprint.memory > budget:
+            raise InsufficientResources(
+                f"Not enough memory: the run needs about {format_bytes(footprint.memory)}, "
+                f"{format_bytes(max(budget, 0))} is available "
+                f"(keeping {format_bytes(MEMORY_RESERVE)}, see MEMORY_RESERVE)"
+            )
+
+    room = Workspace.room()
+    if footprint.disk > room and settings.fmt == FileFormat.TIFF:
+        smaller = replace(settings, fmt=FileFormat.TIFF_LZW)
+        if (cheaper := estimate_footprint(layer_sizes, smaller)).disk <= room:
+            settings, footprint = smaller, cheaper
+    if footprint.disk > room:
+        raise InsufficientResources(
+            f"Not enough temp space: the run needs about {format_bytes(footprint.disk)}, "
+            f"at most {format_bytes(room)} is free, set NIK_TEMP_PATH to a larger folder"
+        )
+    return settings, footprint
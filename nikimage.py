@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+"""
+Pure Python encoders and a decoder for the intermediate files, independent of GIMP.
+They write raw pixels pulled from a layer's buffer without going through GIMP's file plug-ins.
+
+LICENSE:
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+This program is licensed under the GNU General Public License v3 (GPLv3).
+
+CONTRIBUTING:
+For bug fixes & updates: https://iiey.github.io/nikgimp
+Issues and contributing: https://github.com/iiey/nikgimp
+"""
+
+from array import array
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Tuple
+
+import os
+import struct
+import sys
+import zlib
+
+# Approximate size of a TIFF strip and of the rows compressed at once for PNG
+CHUNK_SIZE: int = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class PixelData:
+    """Interleaved pixels of an image, 16-bit samples in native byte order"""
+
+    width: int
+    height: int
+    channels: int
+    bits: int
+    data: bytes
+
+    @property
+    def row_size(self) -> int:
+        return self.width * self.channels * self.bits // 8
+
+    @property
+    def has_alpha(self) -> bool:
+        return self.channels in (2, 4)
+
+    def rows_per_chunk(self) -> int:
+        return max(1, min(self.height, CHUNK_SIZE // max(1, self.row_size)))
+
+
+def write_tiff(file: BinaryIO, pixels: PixelData) -> None:
+    """Baseline uncompressed TIFF, strips of about CHUNK_SIZE"""
+
+    byte_order = b"II" if sys.byteorder == "little" else b"MM"
+    prefix = "<" if sys.byteorder == "little" else ">"
+    rows_per_strip = pixels.rows_per_chunk()
+    strip_size = rows_per_strip * pixels.row_size
+    n_strips = -(-pixels.height // rows_per_strip)
+    byte_counts = [strip_size] * n_strips
+    byte_counts[-1] = len(pixels.data) - strip_size * (n_strips - 1)
+
+    # (tag, type, values), types: 3 SHORT, 4 LONG, 5 RATIONAL
+    tags: List[Tuple[int, int, List[int]]] = [
+        (256, 4, [pixels.width]),
+        (257, 4, [pixels.height]),
+        (258, 3, [pixels.bits] * pixels.channels),
+        (259, 3, [1]),
+        (262, 3, [2 if pixels.channels >= 3 else 1]),
+        (273, 4, [0] * n_strips),
+        (277, 3, [pixels.channels]),
+        (278, 4, [rows_per_strip]),
+        (279, 4, byte_counts),
+        (282, 5, [72, 1]),
+        (283, 5, [72, 1]),
+        (284, 3, [1]),
+        (296, 3, [2]),
+    ]
+    if pixels.has_alpha:
+        # unassociated alpha
+        tags.append((338, 3, [2]))
+
+    type_formats = {3: "H", 4: "I", 5: "I"}
+    ifd_size = 2 + 12 * len(tags) + 4
+    # values not fitting into the 4 bytes of an entry follow the IFD
+    extra_size = sum(
+        len(values) * 4 if kind != 3 else len(values) * 2
+        for _, kind, values in tags
+        if (len(values) * (2 if kind == 3 else 4)) > 4
+    )
+    data_offset = 8 + ifd_size + extra_size
+    offsets = [data_offset + i * strip_size for i in range(n_strips)]
+    tags[5] = (273, 4, offsets)
+
+    header = byte_order + struct.pack(prefix + "HI", 42, 8)
+    entries = struct.pack(prefix + "H", len(tags))
+    extra = b""
+    extra_offset = 8 + ifd_size
+    for tag, kind, values in tags:
+        packed = struct.pack(prefix + type_formats[kind] * len(values), *values)
+        count = len(values) // 2 if kind == 5 else len(values)
+        if len(packed) <= 4:
+            entries += struct.pack(prefix + "HHI", tag, kind, count)
+            entries += packed.ljust(4, b"\0")
+        else:
+            entries += struct.pack(prefix + "HHII", tag, kind, count, extra_offset)
+            extra += packed
+            extra_offset += len(packed)
+    entries += struct.pack(prefix + "I", 0)
+
+    file.write(header + entries + extra)
+    file.write(pixels.data)
+
+
+def write_png(file: BinaryIO, pixels: PixelData, level: int) -> None:
+    """PNG without row filters, compressed by zlib with the given level"""
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        crc = zlib.crc32(kind + body) & 0xFFFFFFFF
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", crc)
+
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[pixels.channels]
+    file.write(b"\x89PNG\r\n\x1a\n")
+    file.write(
+        chunk(
+            b"IHDR",
+            struct.pack(
+                ">IIBBBBB",
+                pixels.width,
+                pixels.height,
+                pixels.bits,
+                color_type,
+                0,
+                0,
+                0,
+            ),
+        )
+    )
+
+    data = memoryview(pixels.data)
+    if pixels.bits == 16 and sys.byteorder == "little":
+        # png samples are big endian
+        swapped = array("H", pixels.data)
+        swapped.byteswap()
+        data = memoryview(swapped).cast("B")
+
+    compressor = zlib.compressobj(level)
+    row_size = pixels.row_size
+    step = pixels.rows_per_chunk()
+    for start in range(0, pixels.height, step):
+        rows = range(start, min(start + step, pixels.height))
+        # filter type 0 (none) in front of each row
+        raw = b"".join(
+            b"\0" + data[row * row_size : (row + 1) * row_size] for row in rows
+        )
+        if compressed := compressor.compress(raw):
+            file.write(chunk(b"IDAT", compressed))
+    file.write(chunk(b"IDAT", compressor.flush()))
+    file.write(chunk(b"IEND", b""))
+
+
+def write_image(path: str, pixels: PixelData, fmt: str, png_level: int = 1) -> None:
+    """Encode pixels to path, fmt is 'tiff' (uncompressed) or 'png'"""
+
+    with open(path, "wb") as file:
+        if fmt == "tiff":
+            write_tiff(file, pixels)
+        elif fmt == "png":
+            write_png(file, pixels, png_level)
+        else:
+            raise ValueError(f"No encoder for format: {fmt}")
+
+
+def write_images(
+    items: List[Tuple[str, PixelData]],
+    fmt: str,
+    png_level: int = 1,
+    workers: int = 0,
+) -> None:
+    """
+    Encode several images at once
+    Threads run truly parallel here since zlib and file I/O release the GIL,
+    unlike worker processes they need neither pickling the pixels nor a new interpreter
+    Args:
+        workers: Number of threads, 0 for one per image up to the CPU count, 1 for serial
+    """
+
+    workers = workers or min(len(items), os.cpu_count() or 1)
+    if workers <= 1:
+        for path, pixels in items:
+            write_image(path, pixels, fmt, png_level)
+        return
+
+    # imported on use, it pulls in logging and more at the plugin's registration
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(write_image, path, pixels, fmt, png_level)
+            for path, pixels in items
+        ]
+        for future in futures:
+            future.result()
+
+
+class TiffReader:  # pylint: disable=R0902
+    """
+    Row-wise reader for uncompressed, chunky (interleaved) 8/16-bit TIFF,
+    e.g. as written by write_tiff(), 16-bit samples are returned in native byte order
+    Raises ValueError for anything else, callers fall back to GIMP's loader
+    """
+
+    TYPE_SIZES = {3: ("H", 2), 4: ("I", 4)}
+
+    def __init__(self, path: str) -> None:
+        self.prefix = "<"
+        self.width = self.height = self.channels = self.bits = 0
+        self.row_size = self.rows_per_strip = 0
+        self.strip_offsets: List[int] = []
+        self.needs_swap = False
+        self.file = open(path, "rb")  # pylint: disable=R1732
+        try:
+            self.parse()
+        except (ValueError, struct.error, KeyError):
+            self.file.close()
+            raise
+        except OSError as error:
+            self.file.close()
+            raise ValueError(str(error)) from error
+
+    def __enter__(self) -> "TiffReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def read_tags(self) -> dict:
+        """Tags of the first IFD with SHORT and LONG values"""
+
+        header = self.file.read(8)
+        if header[:2] not in (b"II", b"MM"):
+            raise ValueError("Not a TIFF file")
+        self.prefix = "<" if header[:2] == b"II" else ">"
+        magic, ifd_offset = struct.unpack(self.prefix + "HI", header[2:])
+        if magic != 42:
+            raise ValueError("BigTIFF or invalid TIFF")
+
+        self.file.seek(ifd_offset)
+        (count,) = struct.unpack(self.prefix + "H", self.file.read(2))
+        entries = self.file.read(12 * count)
+        tags = {}
+        for i in range(count):
+            tag, kind, num, value = struct.unpack_from(
+                self.prefix + "HHI4s", entries, 12 * i
+            )
+            if kind not in self.TYPE_SIZES:
+                continue
+            code, size = self.TYPE_SIZES[kind]
+            if num * size > 4:
+                (offset,) = struct.unpack(self.prefix + "I", value)
+                self.file.seek(offset)
+                value = self.file.read(num * size)
+            tags[tag] = list(struct.unpack_from(self.prefix + code * num, value))
+        return tags
+
+    def parse(self) -> None:
+        tags = self.read_tags()
+        if tags.get(259, [1])[0] != 1:
+            raise ValueError("Compressed TIFF")
+        if tags.get(284, [1])[0] != 1 or 322 in tags:
+            raise ValueError("Planar or tiled TIFF")
+        if tags[262][0] not in (1, 2) or tags.get(338, [0])[0] == 1:
+            raise ValueError("Unsupported photometric or associated alpha")
+
+        self.width = tags[256][0]
+        self.height = tags[257][0]
+        self.channels = tags.get(277, [1])[0]
+        bits = set(tags.get(258, [1]))
+        if len(bits) != 1 or bits.issubset({8, 16}) is False or self.channels > 4:
+            raise ValueError("Unsupported samples")
+        self.bits = bits.pop()
+        self.row_size = self.width * self.channels * self.bits // 8
+        self.rows_per_strip = min(tags.get(278, [self.height])[0], self.height)
+        self.strip_offsets = tags[273]
+        swap_order = (self.prefix == "<") != (sys.byteorder == "little")
+        self.needs_swap = self.bits == 16 and swap_order
+
+    def read_rows(self, start: int, count: int) -> bytes:
+        """Pixel rows [start, start + count) as contiguous bytes"""
+
+        parts = []
+        row = start
+        end = min(start + count, self.height)
+        while row < end:
+            strip, offset = divmod(row, self.rows_per_strip)
+            rows = min(end - row, self.rows_per_strip - offset)
+            self.file.seek(self.strip_offsets[strip] + offset * self.row_size)
+            parts.append(self.file.read(rows * self.row_size))
+            row += rows
+        data = b"".join(parts)
+        if len(data) != (end - start) * self.row_size:
+            raise ValueError("Truncated TIFF")
+        if self.needs_swap:
+            swapped = array("H", data)
+            swapped.byteswap()
+            data = swapped.tobytes()
+        return data
+
+
+def open_image(path: str) -> Optional[TiffReader]:
+    """Row-wise reader for the file, None if its format isn't supported"""
+
+    try:
+        return TiffReader(path)
+    except ValueError:
+        return None
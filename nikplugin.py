@@ -21,32 +21,44 @@ gi.require_version("Gimp", "3.0")
 gi.require_version("GimpUi", "3.0")
 gi.require_version("Gegl", "0.4")
 
+# NOTE: GIMP runs the plugin at each start to register its procedures,
+# only what registration needs is imported here, Gegl, GimpUi and Gtk when a procedure runs
 from gi.repository import (
     GLib,
     GObject,
-    Gegl,
     Gimp,
-    GimpUi,
     Gio,
-    Gtk,
 )
 
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from typing import Any, Callable, List, Optional, Tuple, Union
 
-import os
-import shutil
-import subprocess
 import sys
-import tempfile
-import traceback
-
-
-# NOTE: Specify IF your installation is not in the default location
-# e.g. D:/plugins/nikcollection
-NIK_BASE_PATH: str = ""
-
+import time
+
+import nikcore
+import nikimage
+from nikcore import (
+    Cancelled,
+    ExportSettings,
+    FileFormat,
+    ResultCache,
+    ResultWatcher,
+    Trace,
+    Workspace,
+    build_command,
+    child_usage,
+    get_program_env,
+    is_hdr_prog,
+    launch,
+    run_program,
+    terminate,
+    usage_note,
+    wait_program,
+    warm_wine,
+)
 
 # Define plug-in metadata
 PROC_NAME = "NikCollection"
@@ -55,218 +67,177 @@ DOC = "Call an external program passing the active layer as a temp file"
 AUTHOR = "nemo"
 COPYRIGHT = "GNU General Public License v3"
 DATE = "2025-04-01"
-VERSION = "3.2.2"
+VERSION = "3.3.0-rc"
 
+# x, y, width, height
+Rect = Tuple[int, int, int, int]
 
-def find_nik_install() -> Optional[Path]:
-    """Detect Nik Collection installation path based on operating system"""
+# Image precisions exported with 8 bit per sample, all others with 16 bit
+U8_PRECISIONS = (
+    Gimp.Precision.U8_LINEAR,
+    Gimp.Precision.U8_NON_LINEAR,
+    Gimp.Precision.U8_PERCEPTUAL,
+)
 
-    possible_paths = []
-    # Common installation paths
-    if sys.platform == "win32":
-        possible_paths = [
-            Path("C:/Program Files/DxO"),
-            Path("C:/Program Files/Google"),
-            Path("C:/Program Files (x86)/Google"),
-        ]
-    elif sys.platform == "darwin":
-        possible_paths = [
-            Path("/Applications"),
-            Path("~/Applications"),
-        ]
-    elif sys.platform.startswith("linux"):
-        possible_paths = [
-            Path.home() / ".wine/drive_c/Program Files/DxO",
-            Path.home() / ".wine/drive_c/Program Files/Google",
-        ]
+# Changed tiles are merged per rect up to this count, beyond in one go over their bounds
+MAX_TILE_MERGES = 64
 
-    # Search for all Nik Collection* folders under each base path
-    nik_folders = []
-    for base in possible_paths:
-        if base.is_dir():
-            nik_folders.extend(sorted(base.glob("Nik Collection*"), reverse=True))
-
-    for nik in nik_folders:
-        # DxO: check subfolder e.g. 'Nik Collection 8/bin'
-        if (nik_bin := nik / "bin").is_dir():
-            # stop at highest version (first in sorted list)
-            return nik_bin
-        # Google: check program subfolders (.app are folder in macOS too)
-        if any(d.is_dir() for d in nik.iterdir()):
-            return nik
-
-    # Fallback to user-configured path if specified
-    if NIK_BASE_PATH and (nik_path := Path(NIK_BASE_PATH)).is_dir():
-        return nik_path
-
-    show_alert(
-        text=f"{PROC_NAME} installation path not found",
-        message=(
-            "Please specify the correct installation path in the script.\n"
-            f"{NIK_BASE_PATH=}"
-        ),
-    )
+# Chain procedure
+CHAIN_PROC_NAME = "NikCollectionChain"
+CHAIN_HELP = "Call several external programs one after another"
+CHAIN_DOC = (
+    "Call several external programs on the same intermediate file "
+    "and import the final result as one step"
+)
 
-    return None
+# Batch procedure
+BATCH_PROC_NAME = "NikCollectionBatch"
+BATCH_HELP = "Call an external program on several images"
+BATCH_DOC = "Call an external program on all open images or the image files of a folder"
+# Results of folder runs are saved into this subfolder
+BATCH_OUTPUT_FOLDER = "nik"
+BATCH_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+# Resident process, see RESIDENT_MODE in nikcore.py
+RESIDENT_PROC_NAME = "NikCollectionResident"
+RESIDENT_HELP = "Serve the Nik Collection procedures from one process"
+RESIDENT_DOC = (
+    "Started with GIMP or by the first run, registers the procedures again as "
+    "temporary ones the menu entries hand their runs over to, exits when idle"
+)
+# Names of the temporary procedures are the ones of the menu entries plus this
+RESIDENT_SUFFIX = "-resident"
 
 
-def list_mac_progs(base_path: Path) -> List[Tuple[str, Path]]:
-    """Function for both Google & DxO version (under macOS)
-    i.e.: /Applications/Nik Collection/program_name.app
-    """
+def list_progs(idx: Optional[int] = None) -> Union[List[str], Tuple[str, Path]]:
+    """Installed programs, the discovery index lives in the GIMP config folder"""
 
-    mac_progs: List[Tuple[str, Path]] = []
-    for prog_item in base_path.iterdir():
-        if prog_item.is_dir() and prog_item.suffix == ".app":
-            mac_progs.append((prog_item.stem, prog_item))
-    return mac_progs
+    return nikcore.list_progs(idx, Path(Gimp.directory()))
 
 
-def list_dxo_progs(base_path: Path) -> List[Tuple[str, Path]]:
-    """Function for DxO version (under windows)
-    i.e.: ../DxO/Nik Collection N/bin/program_name.exe
-    """
+def show_alert(text: str, message: str, parent=None) -> None:
+    """Popup a message dialog with the given text and message"""
 
-    if "bin" not in base_path.name:
-        return []
+    from gi.repository import Gtk
 
-    dxo_progs: List[Tuple[str, Path]] = []
-    for prog_item in base_path.iterdir():
-        if (
-            prog_item.is_file()
-            and "nik" in prog_item.name.lower()
-            and prog_item.suffix == ".exe"
-        ):
-            dxo_progs.append((prog_item.stem, prog_item))
-    return dxo_progs
+    dialog = Gtk.MessageDialog(
+        transient_for=parent,
+        flags=0,
+        message_type=Gtk.MessageType.ERROR,
+        buttons=Gtk.ButtonsType.CLOSE,
+        text=text,
+    )
+    dialog.format_secondary_text(message)
+    dialog.set_title(f"{PROC_NAME} v{VERSION}")
+    dialog.run()
+    dialog.destroy()
 
 
-def list_google_progs(base_path: Path) -> List[Tuple[str, Path]]:
-    """
-    Function for Google version (under windows)
-    There could be 64-bit folder (favoured) in program folder under `base_path`
-    Returns:
-        List of (prog_name, exec_path)
-    """
+# Report core problems with a dialog
+nikcore.alert = show_alert
 
-    def get_prog_details(prog_dir: Path) -> Optional[Tuple[str, Path]]:
-        exec_file = None
-        bit64_dirs = [
-            d for d in prog_dir.iterdir() if d.is_dir() and "64-bit" in d.name.lower()
-        ]
-        # prefer 64-bit version
-        if bit64_dirs:
-            exec_file = next(bit64_dirs[0].glob("*.exe"), None)
-        # fallback default binary
-        if exec_file is None:
-            exec_file = next(prog_dir.glob("*.exe"), None)
-        # return one of above
-        return (prog_dir.name, exec_file) if exec_file else None
 
-    progs: List[Tuple[str, Path]] = []
-    sub_dirs = [d for d in base_path.iterdir() if d.is_dir()]
+def report_error(procedure: Gimp.Procedure, error: Exception) -> Gimp.ValueArray:
+    """Show the error with its traceback and return it as the procedure's result"""
 
-    for prog_dir in sub_dirs:
-        if prog_detail := get_prog_details(prog_dir):
-            progs.append(prog_detail)
+    import traceback
 
-    return progs
+    details = traceback.format_exc()
+    show_alert(text=str(error), message=details)
+    return procedure.new_return_values(
+        Gimp.PDBStatusType.EXECUTION_ERROR,
+        GLib.Error(message=f"{str(error)}\n\n{details}"),
+    )
 
 
-def list_progs(idx: Optional[int] = None) -> Union[List[str], Tuple[str, Path]]:
-    """
-    Build a list of Nik programs installed on the system
-    Args:
-        idx: Optional index of the program to return details for
-    Returns:
-        If idx is None, returns a list of program names
-        Otherwise, returns [prog_name, prog_filepath] for the specified program
-    """
+def run_dialog(
+    procedure: Gimp.Procedure,
+    config: Gimp.ProcedureConfig,
+    properties: Optional[List[str]] = None,
+) -> bool:
+    """Show the procedure's dialog with the given properties (default all), False if cancelled"""
 
-    if not (base_path := find_nik_install()):
-        return []
+    from gi.repository import Gegl, GimpUi
 
-    progs_lst: List[Tuple[str, Path]] = []
-    # on mac, programs located directly under installation folder
-    if sys.platform == "darwin":
-        progs_lst.extend(list_mac_progs(base_path))
-    # on win or linx+wine
-    else:
-        progs_lst.extend(list_dxo_progs(base_path))
-        progs_lst.extend(list_google_progs(base_path))
+    GimpUi.init(procedure.get_name())
+    Gegl.init(None)
+    dialog = GimpUi.ProcedureDialog(procedure=procedure, config=config)
+    dialog.fill(properties)
+    confirmed = dialog.run()
+    dialog.destroy()
+    return confirmed
 
-    progs_lst.sort(key=lambda x: x[0].lower())  # sort alphabetically
 
-    if idx is None:
-        return [prog[0] for prog in progs_lst]
-    if 0 <= idx < len(progs_lst):
-        return progs_lst[idx]
-    return []  # invalid index
+def base_name(procedure: Gimp.Procedure) -> str:
+    """Name of the procedure without the suffix of the resident's temporary procedures"""
 
+    return procedure.get_name().removesuffix(RESIDENT_SUFFIX)
 
-def find_hdr_output(prog: str, input_path: Path) -> Optional[Path]:
+
+def forward_to_resident(
+    procedure: Gimp.Procedure,
+    run_mode: Gimp.RunMode,
+    image: Gimp.Image,
+    drawables: List[Gimp.Drawable],
+    config: Gimp.ProcedureConfig,
+) -> Optional[Gimp.ValueArray]:
     """
-    Guess output file of 'prog' based on OS
-    It typically extends original input file with '_HDR' and stores under the Documents folder
+    Hand the run over to the resident process if resident mode is enabled,
+    the resident is started first if it isn't up (anymore)
+    Returns:
+        The resident's return values or None to run in this process
     """
 
-    # NOTE: workaround for troublesome program
-    if prog != "HDR Efex Pro 2":
+    if (
+        not nikcore.RESIDENT_MODE
+        or procedure.get_proc_type() != Gimp.PDBProcType.PLUGIN
+    ):
         return None
 
-    fname = f"{input_path.stem}_HDR{input_path.suffix}"
-    # NOTE: extend paths correspondingly if you custom your documents folder
-    if sys.platform in "win32":
-        candidate_paths = [
-            Path.home() / "Documents",
-            Path("D:/Documents"),
-        ]
-    if sys.platform == "darwin":
-        # NOTE: extend to where intermediate files are stored
-        candidate_paths = [
-            Path.home(),
-            Path.home() / "Documents",
-            Path.home() / "Pictures",
-        ]
-    elif sys.platform.startswith("linux"):
-        wine_user = os.environ.get("USER", os.environ.get("USERNAME", "user"))
-        candidate_paths = [
-            Path.home() / f".wine/drive_c/users/{wine_user}/My Documents",
-        ]
-
-    doc_paths = [p for p in candidate_paths if p.is_dir()]
-    for path in doc_paths:
-        if (out_path := (path / fname).resolve()).is_file():
-            return out_path
-
-    if not doc_paths:
-        show_alert(
-            text=f"{prog}: Folder not found",
-            message="Plugin cannot identify 'Documents' on your system.",
-        )
+    startup = nikcore.process_age()
+    pdb = Gimp.get_pdb()
+    name = procedure.get_name() + RESIDENT_SUFFIX
+    if not pdb.procedure_exists(name) and (
+        resident := pdb.lookup_procedure(RESIDENT_PROC_NAME)
+    ):
+        # returns as soon as the resident registered its procedures
+        resident.run(resident.create_config())
+    if not (target := pdb.lookup_procedure(name)):
         return None
 
-    show_alert(
-        text=f"{prog}: File not found",
-        message=f"Plugin cannot find the output {fname} in 'Documents'.",
+    # interactive runs and repeats use the resident's last values instead
+    target_config = target.create_config()
+    for spec in config.list_properties():
+        if spec.name in ("procedure", "run-mode", "image", "drawables"):
+            continue
+        if not target_config.find_property(spec.name):
+            continue
+        if spec.value_type.name == "GimpCoreObjectArray":
+            objects = config.get_core_object_array(spec.name)
+            target_config.set_core_object_array(spec.name, objects)
+        else:
+            target_config.set_property(spec.name, config.get_property(spec.name))
+    target_config.set_property("run-mode", run_mode)
+    target_config.set_property("image", image)
+    target_config.set_core_object_array("drawables", drawables)
+
+    # the resident traces the run itself, this is the share of the starting process
+    trace = Trace(
+        nikcore.get_trace_path(Path(Gimp.directory())),
+        prog=f"{procedure.get_name()} (forwarded)",
     )
-    return None
-
-
-def show_alert(text: str, message: str, parent=None) -> None:
-    """Popup a message dialog with the given text and message"""
-
-    dialog = Gtk.MessageDialog(
-        transient_for=parent,
-        flags=0,
-        message_type=Gtk.MessageType.ERROR,
-        buttons=Gtk.ButtonsType.CLOSE,
-        text=text,
-    )
-    dialog.format_secondary_text(message)
-    dialog.set_title(f"{PROC_NAME} v{VERSION}")
-    dialog.run()
-    dialog.destroy()
+    trace.add("startup", startup)
+    with trace.stage("forward"):
+        result = target.run(target_config)
+    if result.index(0) not in (
+        Gimp.PDBStatusType.SUCCESS,
+        Gimp.PDBStatusType.CANCEL,
+    ) and not pdb.procedure_exists(name):
+        # the resident went away meanwhile e.g. exiting when idle, run here instead
+        trace.save("resident gone")
+        return None
+    trace.save("forwarded")
+    return result
 
 
 def prepare_data(
@@ -274,14 +245,16 @@ def prepare_data(
     visible: str,
     prog_name: str,
     is_hdr: bool,
-) -> Tuple[Gimp.Layer, List[Gimp.Image]]:
-    """Prepare target layer(s) and create tmp image filepath(s)
+    roi: Optional[Rect] = None,
+) -> Tuple[Gimp.Layer, List[Gimp.Layer]]:
+    """Prepare target layer and determine the source layer(s)
+    With roi, a new layer only covers that region
     Returns:
         target_layer: where the final result will be written to
-        tm_image(s): list of temporary images created from the selected layers
+        source_layers: layers whose pixels are handed over to the program
     """
 
-    # Clear current selection to avoid wrongly pasting the processed image
+    # Clear current selection, it would limit merging the result (see limit_merge())
     if not Gimp.Selection.is_empty(image):
         Gimp.Selection.none(image)
 
@@ -291,211 +264,1519 @@ def prepare_data(
     if visible == LayerSource.CURRENT_LAYER:
         target_layer = selected_layers[0]
         source_layers = [target_layer]
+    elif visible == LayerSource.SELECTED_LAYERS:
+        # each layer is the target of its own result, see run_each_layer()
+        target_layer = selected_layers[0]
+        source_layers = selected_layers
     else:
         # Prepare a new layer from all the visible layers
         target_layer = Gimp.Layer.new_from_visible(image, image, prog_name)
         image.insert_layer(target_layer, None, 0)
+        if roi:
+            target_layer.resize(roi[2], roi[3], -roi[0], -roi[1])
         # For hdr program, we use all the user selected layers as inputs
         source_layers = [target_layer] if not is_hdr else selected_layers
 
-    # Create temporary images from source layers
-    tmp_images: List[Gimp.Image] = []
-    for layer in source_layers:
-        buffer = Gimp.edit_named_copy([layer], "ShellOutTemp")
-        tmp_img = Gimp.edit_named_paste_as_new_image(buffer)
-        if not tmp_img:
-            raise RuntimeError(f"Failed creating tmp image from: {layer.get_name()}")
-        Gimp.Image.undo_disable(tmp_img)
-        tmp_images.append(tmp_img)
+    return target_layer, source_layers
 
-    Gimp.buffer_delete(buffer)
-    return target_layer, tmp_images
 
+def get_roi(image: Gimp.Image, margin: int) -> Optional[Rect]:
+    """Selection bounds grown by margin and clipped to the image, None without selection"""
 
-def process_result(
+    _, non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)
+    if not non_empty:
+        return None
+    x1, y1 = max(x1 - margin, 0), max(y1 - margin, 0)
+    x2 = min(x2 + margin, image.get_width())
+    y2 = min(y2 + margin, image.get_height())
+    return x1, y1, x2 - x1, y2 - y1
+
+
+def layer_rect(layer: Gimp.Drawable, roi: Optional[Rect]) -> Rect:
+    """Part of the layer covered by the image region, in layer coordinates"""
+
+    width, height = layer.get_width(), layer.get_height()
+    if roi is None:
+        return 0, 0, width, height
+    _, off_x, off_y = layer.get_offsets()
+    x1, y1 = max(roi[0] - off_x, 0), max(roi[1] - off_y, 0)
+    x2 = min(roi[0] + roi[2] - off_x, width)
+    y2 = min(roi[1] + roi[3] - off_y, height)
+    if x2 <= x1 or y2 <= y1:
+        raise ValueError(f"Selection is outside of layer '{layer.get_name()}'")
+    return x1, y1, x2 - x1, y2 - y1
+
+
+def limit_merge(
+    image: Gimp.Image,
     target_layer: Gimp.Layer,
-    tmp_img: Gimp.Image,
-    tmp_filepath: str,
+    region: Rect,
+    mask: Optional[Gimp.Channel],
 ) -> None:
-    """Process the result image and integrate it back into GIMP"""
+    """Select where the result is merged into the target: the region or the mask within it"""
 
-    # Integrate image back into gimp
-    # 1. Load image file as layer into tmp image
+    if mask is not None:
+        image.select_item(Gimp.ChannelOps.REPLACE, mask)
+    elif region[2:] == (target_layer.get_width(), target_layer.get_height()):
+        Gimp.Selection.none(image)
+    else:
+        _, off_x, off_y = target_layer.get_offsets()
+        image.select_rectangle(
+            Gimp.ChannelOps.REPLACE, off_x + region[0], off_y + region[1], *region[2:]
+        )
+
+
+def copy_to_image(layer: Gimp.Layer, rect: Optional[Rect] = None) -> Gimp.Image:
+    """Standalone image holding a copy of the layer (or the rect of it),
+    as needed by GIMP's file export
+    """
+
+    image = layer.get_image()
+    tmp_img = Gimp.Image.new_with_precision(
+        layer.get_width(),
+        layer.get_height(),
+        image.get_base_type(),
+        image.get_precision(),
+    )
+    tmp_img.undo_disable()
+    if profile := image.get_color_profile():
+        tmp_img.set_color_profile(profile)
+    tmp_layer = Gimp.Layer.new_from_drawable(layer, tmp_img)
+    tmp_img.insert_layer(tmp_layer, None, 0)
+    tmp_layer.set_offsets(0, 0)
+    if rect and rect[2:] != (layer.get_width(), layer.get_height()):
+        tmp_img.crop(rect[2], rect[3], rect[0], rect[1])
+    return tmp_img
+
+
+def write_bands(
+    drawable: Gimp.Drawable,
+    size: Tuple[int, int],
+    babl_format: str,
+    read_rows: Callable[[int, int], bytes],
+    origin: Tuple[int, int] = (0, 0),
+) -> None:
+    """Write pixels into the drawable's shadow buffer one tile row band at a time
+    and merge them as a single undo step, only one band is held in memory
+    Merging is limited to the image's selection, clear or set it beforehand
+    """
+
+    from gi.repository import Gegl
+
+    width, height = size
+    rows = Gimp.tile_height()
+    shadow = drawable.get_shadow_buffer()
+    for y in range(0, height, rows):
+        count = min(rows, height - y)
+        rect = Gegl.Rectangle.new(origin[0], origin[1] + y, width, count)
+        shadow.set(rect, babl_format, read_rows(y, count))
+        Gimp.progress_update((y + count) / height)
+    shadow.flush()
+    drawable.merge_shadow(True)
+    drawable.update(*origin, width, height)
+
+
+def changed_columns(
+    new: bytes, old: bytes, row_size: int, tile_size: int
+) -> List[bool]:
+    """Per tile column (tile_size bytes wide) of a band, whether any of its rows differs"""
+
+    columns = -(-row_size // tile_size)
+    if new == old:
+        return [False] * columns
+    dirty = [False] * columns
+    for start in range(0, len(new), row_size):
+        end = start + row_size
+        if new[start:end] == old[start:end]:
+            continue
+        for col in range(columns):
+            if not dirty[col]:
+                left = start + col * tile_size
+                right = min(left + tile_size, end)
+                dirty[col] = new[left:right] != old[left:right]
+        if all(dirty):
+            break
+    return dirty
+
+
+def merge_rects(drawable: Gimp.Drawable, rects: List[Rect]) -> None:
+    """
+    Merge the shadow buffer only within the rects, through the current selection if any
+    Each merge stores just its rect for undo, many rects are merged at once instead
+    """
+
+    image = drawable.get_image()
+    limit = save_selection(image)
+    _, off_x, off_y = drawable.get_offsets()
+    groups = [[rect] for rect in rects] if len(rects) <= MAX_TILE_MERGES else [rects]
+    try:
+        for group in groups:
+            for i, (x, y, width, height) in enumerate(group):
+                operation = Gimp.ChannelOps.REPLACE if i == 0 else Gimp.ChannelOps.ADD
+                image.select_rectangle(operation, off_x + x, off_y + y, width, height)
+            if limit is not None:
+                image.select_item(Gimp.ChannelOps.INTERSECT, limit)
+                # an empty selection would merge everything
+                if Gimp.Selection.is_empty(image):
+                    continue
+            drawable.merge_shadow(True)
+            x1, y1 = min(r[0] for r in group), min(r[1] for r in group)
+            x2 = max(r[0] + r[2] for r in group)
+            y2 = max(r[1] + r[3] for r in group)
+            drawable.update(x1, y1, x2 - x1, y2 - y1)
+    finally:
+        if limit is not None:
+            restore_selection(image, limit)
+        else:
+            Gimp.Selection.none(image)
+
+
+def write_changed_tiles(
+    drawable: Gimp.Drawable,
+    size: Tuple[int, int],
+    babl_format: str,
+    read_rows: Callable[[int, int], bytes],
+    origin: Tuple[int, int] = (0, 0),
+) -> Tuple[int, int]:
+    """Like write_bands() but compare the pixels with the drawable's tile by tile
+    and write and merge only the changed tiles, adjacent ones as one rect
+    Returns:
+        Number of changed tiles and of all tiles
+    """
+
+    from gi.repository import Gegl
+
+    width, height = size
+    tile_width, tile_height = Gimp.tile_width(), Gimp.tile_height()
+    buffer = drawable.get_buffer()
+    shadow = drawable.get_shadow_buffer()
+    # rects of the band before by their (x, width), extended while the next band has them too
+    rects: List[Rect] = []
+    open_rects: dict = {}
+    changed = total = 0
+    for y in range(0, height, tile_height):
+        count = min(tile_height, height - y)
+        new = read_rows(y, count)
+        row_size = len(new) // count
+        bpp = row_size // width
+        band = Gegl.Rectangle.new(origin[0], origin[1] + y, width, count)
+        old = bytes(buffer.get(band, 1.0, babl_format, Gegl.AbyssPolicy.NONE))
+        dirty = changed_columns(new, old, row_size, tile_width * bpp)
+        changed += sum(dirty)
+        total += len(dirty)
+
+        runs = []
+        col = 0
+        while col < len(dirty):
+            if not dirty[col]:
+                col += 1
+                continue
+            first = col
+            while col < len(dirty) and dirty[col]:
+                col += 1
+            left, right = first * tile_width, min(col * tile_width, width)
+            runs.append((left, right - left))
+            data = b"".join(
+                new[row * row_size + left * bpp : row * row_size + right * bpp]
+                for row in range(count)
+            )
+            rect = Gegl.Rectangle.new(
+                origin[0] + left, origin[1] + y, right - left, count
+            )
+            shadow.set(rect, babl_format, data)
+
+        following = {}
+        for left, run_width in runs:
+            if (idx := open_rects.get((left, run_width))) is not None:
+                x, top, _, rect_height = rects[idx]
+                rects[idx] = (x, top, run_width, rect_height + count)
+            else:
+                idx = len(rects)
+                rects.append((origin[0] + left, origin[1] + y, run_width, count))
+            following[(left, run_width)] = idx
+        open_rects = following
+        Gimp.progress_update((y + count) / height)
+
+    shadow.flush()
+    if rects:
+        merge_rects(drawable, rects)
+    return changed, total
+
+
+def load_result(
+    target_layer: Gimp.Layer, source_size: Tuple[int, int], tmp_filepath: str
+) -> Tuple[Gimp.Image, Tuple[int, int], str, Callable[[int, int], bytes]]:
+    """Load the result by GIMP into a temporary image in the target's space
+    Returns the image, the result's size, the babl format and a reader of its rows
+    """
+
+    from gi.repository import Gegl
+
+    image = target_layer.get_image()
+    tmp_img = Gimp.Image.new_with_precision(
+        *source_size, image.get_base_type(), image.get_precision()
+    )
+    tmp_img.undo_disable()
+    if profile := image.get_color_profile():
+        tmp_img.set_color_profile(profile)
     filtered: Gimp.Layer = Gimp.file_load_layer(
         run_mode=Gimp.RunMode.NONINTERACTIVE,
         image=tmp_img,
         file=Gio.File.new_for_path(tmp_filepath),
     )
-    # 2. the returned layer needs to be added to the image
     tmp_img.insert_layer(filtered, None, 0)
+    size = (filtered.get_width(), filtered.get_height())
+    fmt, channels, _ = drawable_format(target_layer)
+    if not is_srgb(image):
+        # unbounded float keeps the colours outside of sRGB
+        fmt = pixel_format(channels, 32)
+    buffer = filtered.get_buffer()
+
+    def read_rows(y: int, count: int) -> bytes:
+        rect = Gegl.Rectangle.new(0, y, size[0], count)
+        return bytes(buffer.get(rect, 1.0, fmt, Gegl.AbyssPolicy.NONE))
+
+    return tmp_img, size, fmt, read_rows
+
+
+def process_result(
+    target_layer: Gimp.Layer,
+    source_size: Tuple[int, int],
+    tmp_filepath: str,
+    region: Optional[Rect] = None,
+) -> Optional[Tuple[int, int]]:
+    """Process the result image and integrate it back into GIMP
+    Uncompressed TIFF is streamed from the file into the target layer,
+    other formats are loaded by GIMP into a temporary image and copied band-wise
+    Args:
+        region: Rect of the target layer the result belongs to, None for the whole layer
+    Returns:
+        Changed and all tiles if only the changed ones were written (WRITE_CHANGED_TILES)
+    """
+
+    Gimp.progress_init("Importing result")
+    # files of other spaces carry their profile, GIMP's loader applies it
+    use_reader = nikcore.BUILTIN_CODECS and is_srgb(target_layer.get_image())
+    reader = nikimage.open_image(tmp_filepath) if use_reader else None
+    tmp_img = None
+    if reader is not None:
+        size = (reader.width, reader.height)
+        fmt = pixel_format(reader.channels, reader.bits)
+        read_rows = reader.read_rows
+    else:
+        tmp_img, size, fmt, read_rows = load_result(
+            target_layer, source_size, tmp_filepath
+        )
+
+    try:
+        if region is not None:
+            # a part of the layer is replaced in place
+            if size != region[2:]:
+                raise RuntimeError(
+                    f"Result size {size} differs from the selection {region[2:]}"
+                )
+            if nikcore.WRITE_CHANGED_TILES:
+                return write_changed_tiles(
+                    target_layer, size, fmt, read_rows, region[:2]
+                )
+            write_bands(target_layer, size, fmt, read_rows, region[:2])
+            return None
+        same_size = size == (target_layer.get_width(), target_layer.get_height())
+        if same_size and nikcore.WRITE_CHANGED_TILES:
+            return write_changed_tiles(target_layer, size, fmt, read_rows)
+        # Align size and position, the result stays centered on the source
+        if not same_size:
+            target_layer.resize(*size, 0, 0)
+        if size != source_size:
+            Gimp.Item.transform_translate(
+                target_layer,
+                (source_size[0] - size[0]) / 2,
+                (source_size[1] - size[1]) / 2,
+            )
+        write_bands(target_layer, size, fmt, read_rows)
+        return None
+    finally:
+        if reader is not None:
+            reader.close()
+        if tmp_img is not None:
+            tmp_img.delete()
+
+
+def layer_sizes(layers: List[Gimp.Layer], roi: Optional[Rect] = None) -> List[int]:
+    """Bytes of the exchanged 8/16-bit pixels per layer (or of their part within roi)"""
+
+    sizes = []
+    for layer in layers:
+        _, channels, bits = drawable_format(layer)
+        _, _, width, height = layer_rect(layer, roi)
+        sizes.append(width * height * channels * bits // 8)
+    return sizes
+
+
+def input_sizes(
+    image: Gimp.Image, visible: str, is_hdr: bool, roi: Optional[Rect] = None
+) -> List[int]:
+    """Like layer_sizes() for the inputs prepare_data() will pick, before it runs"""
+
+    if visible == LayerSource.FROM_VISIBLES and not is_hdr:
+        # the composite has an alpha channel
+        bits = 8 if image.get_precision() in U8_PRECISIONS else 16
+        channels = 1 if image.get_base_type() == Gimp.ImageBaseType.GRAY else 3
+        width, height = roi[2:] if roi else (image.get_width(), image.get_height())
+        return [width * height * (channels + 1) * bits // 8]
+    layers = image.get_selected_layers()
+    return layer_sizes(
+        layers if visible != LayerSource.CURRENT_LAYER else layers[:1], roi
+    )
+
 
-    buffer = Gimp.edit_named_copy([filtered], "ShellOutTemp")
+def admit_run(
+    sizes: List[int],
+    settings: ExportSettings,
+    prog_name: str,
+    trace: Trace,
+) -> Tuple[ExportSettings, Workspace]:
+    """Check the run fits into memory and temp space before exporting, see plan_export()
+    Returns the settings to export with and a workspace sized for the run
+    """
 
-    # Align size and position
-    target_layer.resize(filtered.get_width(), filtered.get_height(), 0, 0)
-    sel = Gimp.edit_named_paste(target_layer, buffer, True)
-    Gimp.Item.transform_translate(
-        target_layer,
-        (tmp_img.get_width() - filtered.get_width()) / 2,
-        (tmp_img.get_height() - filtered.get_height()) / 2,
+    settings, footprint = nikcore.plan_export(sizes, settings.resolve(prog_name))
+    trace.set(
+        estimated_mb=[footprint.memory >> 20, footprint.disk >> 20],
+        streamed=settings.streamed,
     )
+    return settings, Workspace(footprint.disk)
+
+
+def save_image(image: Gimp.Image, filepath: str, settings: ExportSettings) -> None:
+    """Export image through the file plug-in matching the intermediate format"""
+
+    fmt = settings.fmt
+    procedure = Gimp.get_pdb().lookup_procedure(fmt.export_proc)
+    if procedure is None:
+        raise RuntimeError(f"Export procedure not available: {fmt.export_proc}")
+
+    config = procedure.create_config()
+    config.set_property("run-mode", Gimp.RunMode.NONINTERACTIVE)
+    config.set_property("image", image)
+    config.set_property("file", Gio.File.new_for_path(filepath))
+    if fmt in (FileFormat.TIFF, FileFormat.TIFF_LZW):
+        config.set_property(
+            "compression", "lzw" if fmt == FileFormat.TIFF_LZW else "none"
+        )
+    elif fmt == FileFormat.PNG:
+        config.set_property("compression", settings.png_level)
+    elif fmt == FileFormat.JPEG:
+        config.set_property("quality", settings.jpeg_quality / 100)
+
+    result = procedure.run(config)
+    if result.index(0) != Gimp.PDBStatusType.SUCCESS:
+        raise RuntimeError(f"Failed saving intermediate file: {filepath}")
+
+
+def pixel_format(channels: int, bits: int) -> str:
+    """Babl format of interleaved 8/16-bit (32 for float) pixels with 1-4 channels"""
+
+    color = "Y'" if channels <= 2 else "R'G'B'"
+    alpha = "A" if channels in (2, 4) else ""
+    return f"{color}{alpha} {'float' if bits == 32 else f'u{bits}'}"
+
+
+def is_srgb(image: Gimp.Image) -> bool:
+    """
+    The image is in GIMP's built-in sRGB space, where its pixels are exchanged as they are
+    The babl formats used here have no space of their own i.e. they are sRGB,
+    integer samples would clip the colours of wider spaces (AdobeRGB, ProPhoto)
+    """
+
+    if (profile := image.get_color_profile()) is None:
+        return True
+    if image.get_base_type() == Gimp.ImageBaseType.GRAY:
+        return profile.is_equal(Gimp.ColorProfile.new_d65_gray_srgb_trc())
+    return profile.is_equal(Gimp.ColorProfile.new_rgb_srgb())
+
+
+def builtin_encoder(image: Gimp.Image, fmt: FileFormat) -> Optional[str]:
+    """Built-in encoder of the format (see FileFormat.encoder) if the image is sRGB,
+    other images go through GIMP's file export, which embeds their profile
+    """
+
+    return fmt.encoder if fmt.encoder and is_srgb(image) else None
+
+
+def drawable_format(drawable: Gimp.Drawable) -> Tuple[str, int, int]:
+    """Babl format, channels and bits per sample (8 or 16) to exchange the drawable's pixels"""
+
+    bits = 8 if drawable.get_image().get_precision() in U8_PRECISIONS else 16
+    channels = (1 if drawable.is_gray() else 3) + int(drawable.has_alpha())
+    return pixel_format(channels, bits), channels, bits
 
-    target_layer.edit_clear()
-    Gimp.buffer_delete(buffer)
-    Gimp.floating_sel_anchor(sel)
 
+def read_pixels(
+    drawable: Gimp.Drawable, rect: Optional[Rect] = None
+) -> nikimage.PixelData:
+    """Pull the pixels of a drawable (or the rect of it) from its buffer, 8 or 16 bit per sample"""
 
-def cleanup(tmp_filepath: Optional[str], tmp_images: List[Gimp.Image]) -> None:
-    """Clean up temporary resources"""
+    from gi.repository import Gegl
 
-    if tmp_filepath and os.path.exists(tmp_filepath):
-        os.remove(tmp_filepath)
+    babl_format, channels, bits = drawable_format(drawable)
+    buffer = drawable.get_buffer()
+    rect = Gegl.Rectangle.new(*rect) if rect else buffer.get_extent()
+    data = buffer.get(rect, 1.0, babl_format, Gegl.AbyssPolicy.NONE)
+    return nikimage.PixelData(rect.width, rect.height, channels, bits, bytes(data))
 
-    for tmp_img in tmp_images:
-        tmp_img.delete()
 
+def export_paths(
+    workspace: Path, fmt: FileFormat, count: int, stem: str = "tmpNik"
+) -> List[str]:
+    return [str(workspace / f"{stem}_{i}{fmt.suffix}") for i in range(count)]
 
-def run_nik(prog_idx: int, images: List[Gimp.Image]) -> Optional[str]:
-    """Invoke external Nik program"""
 
+def export_images(
+    layers: List[Gimp.Layer],
+    settings: ExportSettings,
+    workspace: Path,
+    stem: str = "tmpNik",
+    roi: Optional[Rect] = None,
+) -> List[str]:
+    """Save the layers (or their part within the image region roi) into the workspace
+    as '{stem}_{i}.ext'
+    Pixels are read directly from the layers' buffers for the built-in encoders,
+    GIMP's file export gets a temporary image per layer, deleted right after saving
+    """
+
+    temp_files = export_paths(workspace, settings.fmt, len(layers), stem)
+
+    if encoder := builtin_encoder(layers[0].get_image(), settings.fmt):
+        Gimp.progress_init(f"Saving {len(layers)} image(s)")
+        items = []
+        for i, (layer, temp_path) in enumerate(zip(layers, temp_files)):
+            pixels = read_pixels(layer, layer_rect(layer, roi))
+            if settings.streamed:
+                # only one layer's pixels are held at a time
+                nikimage.write_image(temp_path, pixels, encoder, settings.png_level)
+            else:
+                items.append((temp_path, pixels))
+            Gimp.progress_update((i + 1) / (len(layers) + 1))
+        # e.g. hdr brackets: pixels pulled once per layer are encoded in parallel
+        nikimage.write_images(items, encoder, settings.png_level)
+        return temp_files
+
+    for i, (layer, temp_path) in enumerate(zip(layers, temp_files)):
+        Gimp.progress_init(f"Saving image {i+1}/{len(layers)}")
+        tmp_img = copy_to_image(layer, layer_rect(layer, roi))
+        try:
+            save_image(tmp_img, temp_path, settings)
+        finally:
+            tmp_img.delete()
+    return temp_files
+
+
+def export_key(image: Gimp.Image, config: Gimp.ProcedureConfig) -> Optional[tuple]:
+    """
+    Choices of the main procedure deciding its exported file: layer source, layer, encoder
+    None if the file can't be exported ahead: hdr inputs, a region, GIMP's file export
+    """
+
+    prog_name = list_progs(int(config.get_property("command")))[0]
+    settings = get_export_settings(config).resolve(prog_name)
+    region_mode = RegionMode(config.get_property("region"))
+    if (
+        is_hdr_prog(prog_name)
+        or not builtin_encoder(image, settings.fmt)
+        or (region_mode != RegionMode.WHOLE and not Gimp.Selection.is_empty(image))
+        or config.get_property("visible") == LayerSource.SELECTED_LAYERS
+    ):
+        return None
+    visible = str(config.get_property("visible"))
+    layer = image.get_selected_layers()[0]
+    layer_id = layer.get_id() if visible == LayerSource.CURRENT_LAYER else 0
+    return visible, layer_id, settings.fmt, settings.png_level
+
+
+class SpeculativeExport:  # pylint: disable=R0902
+    """
+    Export of the likely input while the procedure dialog is open
+    Pixels are read in GLib idle chunks on the main thread, where GIMP must be called,
+    and encoded by a thread. On OK the file is taken if the choices still match,
+    otherwise, or on cancel, it's dropped along with its workspace
+    NOTE: edits of the image while the dialog is open aren't noticed
+    """
+
+    def __init__(self, image: Gimp.Image, key: tuple, disk_size: int) -> None:
+        self.image = image
+        self.key = key
+        visible, _, self.fmt, self.png_level = key
+        self.layer = image.get_selected_layers()[0]
+        self.from_visibles = visible == LayerSource.FROM_VISIBLES
+        self.tmp_img: Optional[Gimp.Image] = None
+        self.source: Optional[Gimp.Drawable] = None
+        self.parts: List[bytes] = []
+        self.row = 0
+        self.thread: Optional["threading.Thread"] = None
+        self.error: Optional[Exception] = None
+
+        self.workspace = Workspace(disk_size)
+        path = self.workspace.__enter__()
+        self.temp_file = export_paths(path, self.fmt, 1)[0]
+        self.idle_id = GLib.idle_add(self.step)
+
+    @classmethod
+    def start(
+        cls, image: Gimp.Image, config: Gimp.ProcedureConfig
+    ) -> Optional["SpeculativeExport"]:
+        """Begin exporting with the dialog's initial choices, None if not possible"""
+
+        try:
+            if (key := export_key(image, config)) is None:
+                return None
+            visible, _, fmt, png_level = key
+            # the same check as the run itself, a cheaper way is left to the run
+            settings, footprint = nikcore.plan_export(
+                input_sizes(image, visible, False),
+                ExportSettings(fmt=fmt, png_level=png_level),
+            )
+            if settings.fmt != fmt or settings.streamed:
+                return None
+            return cls(image, key, footprint.disk)
+        except (OSError, ValueError, IndexError, nikcore.InsufficientResources):
+            return None
+
+    def open_source(self) -> None:
+        if self.from_visibles:
+            # the composite in an image of its own leaves the user's image untouched
+            self.tmp_img = Gimp.Image.new_with_precision(
+                self.image.get_width(),
+                self.image.get_height(),
+                self.image.get_base_type(),
+                self.image.get_precision(),
+            )
+            self.tmp_img.undo_disable()
+            self.source = Gimp.Layer.new_from_visible(
+                self.image, self.tmp_img, PROC_NAME
+            )
+            self.tmp_img.insert_layer(self.source, None, 0)
+        else:
+            self.source = self.layer
+
+    def step(self) -> bool:
+        """Read the next band of rows, True while rows are left (GLib idle callback)"""
+
+        from gi.repository import Gegl
+
+        try:
+            if self.source is None:
+                self.open_source()
+            babl_format, channels, bits = drawable_format(self.source)
+            width, height = self.source.get_width(), self.source.get_height()
+            count = min(4 * Gimp.tile_height(), height - self.row)
+            rect = Gegl.Rectangle.new(0, self.row, width, count)
+            buffer = self.source.get_buffer()
+            data = buffer.get(rect, 1.0, babl_format, Gegl.AbyssPolicy.NONE)
+            self.parts.append(bytes(data))
+            self.row += count
+            if self.row < height:
+                return True
+
+            pixels = nikimage.PixelData(
+                width, height, channels, bits, b"".join(self.parts)
+            )
+            self.parts = []
+            self.close_source()
+            import threading
+
+            self.thread = threading.Thread(target=self.encode, args=(pixels,))
+            self.thread.start()
+        except Exception as error:
+            # an idle callback can't raise, the run exports as usual then
+            self.error = error
+            self.close_source()
+        self.idle_id = 0
+        return False
+
+    def encode(self, pixels: nikimage.PixelData) -> None:
+        try:
+            nikimage.write_image(
+                self.temp_file, pixels, self.fmt.encoder, self.png_level
+            )
+        except (OSError, ValueError) as error:
+            self.error = error
+
+    def close_source(self) -> None:
+        if self.tmp_img is not None:
+            self.tmp_img.delete()
+            self.tmp_img = None
+
+    def stop(self) -> None:
+        """Stop reading, wait for the encoder"""
+
+        if self.idle_id:
+            GLib.source_remove(self.idle_id)
+            self.idle_id = 0
+        if self.thread is not None:
+            self.thread.join()
+        self.close_source()
+
+    def take(self, key: Optional[tuple]) -> Optional[Workspace]:
+        """
+        Finish the export if it was for the given choices
+        Returns:
+            Its workspace holding the file (see export_paths()), None if it was dropped
+        """
+
+        if key != self.key:
+            self.discard()
+            return None
+        if self.idle_id:
+            GLib.source_remove(self.idle_id)
+            self.idle_id = 0
+            while self.step():
+                pass
+        self.stop()
+        if self.error is not None:
+            self.discard()
+            return None
+        return self.workspace
+
+    def discard(self) -> None:
+        self.stop()
+        self.workspace.__exit__(None, None, None)
+
+
+def pulse_progress(prog_name: str) -> Callable[[float], bool]:
+    """Progress callback for a running program, False once GIMP cancelled the progress"""
+
+    def on_tick(elapsed: float) -> bool:
+        return (
+            Gimp.progress_set_text(f"Running {prog_name}... {elapsed:.0f}s")
+            and Gimp.progress_pulse()
+        )
+
+    return on_tick
+
+
+def run_nik(
+    prog_idx: int,
+    layers: List[Gimp.Layer],
+    settings: ExportSettings,
+    workspace: Path,
+    timeout: int = 0,
+    trace: Optional[Trace] = None,
+    reuse_cached: bool = False,
+    roi: Optional[Rect] = None,
+    exported: bool = False,
+) -> Optional[str]:
+    """Invoke external Nik program
+    With reuse_cached, the stored result of an identical run is returned without launching it
+    With roi (image coordinates), only that region of the layers is handed over
+    With exported, the workspace already holds the input (see SpeculativeExport)
+    """
+
+    trace = trace or Trace(None)
     prog_name, prog_filepath = list_progs(prog_idx)
-    is_hdr = "hdr efex pro 2" in prog_name.lower()
+    settings = settings.resolve(prog_name)
+    trace.set(format=settings.fmt.value)
+    cache = ResultCache.create()
+    # wineserver boots while the images are saved, after the lookup if a hit may skip it
+    warm_early = not (cache and reuse_cached)
+    if warm_early:
+        warm_wine(prog_filepath)
     # all other programs work with one input i.e. always idx=0 and saves the result to the same file
     # except hdr program could accept multiple input images
-    temp_files: List[str] = []
+    # the workspace removes all of them when the run is over
+    with trace.stage("export"):
+        if exported:
+            temp_files = export_paths(workspace, settings.fmt, len(layers))
+        else:
+            temp_files = export_images(layers, settings, workspace, roi=roi)
+
+    cache_key = None
+    if cache:
+        cache_key = cache.key(temp_files, prog_filepath, settings.fmt.value)
+        if reuse_cached:
+            if cached := cache.get(cache_key):
+                trace.set(cache="hit")
+                return str(cached)
+            trace.set(cache="miss")
+    if not warm_early:
+        warm_wine(prog_filepath)
+
+    result = run_step(prog_name, prog_filepath, temp_files, timeout, trace)
+    if cache and cache_key and result:
+        cache.put(cache_key, result)
+    return result
+
+
+def run_step(
+    prog_name: str,
+    prog_filepath: Path,
+    temp_files: List[str],
+    timeout: int,
+    trace: Trace,
+) -> Optional[str]:
+    """Run one program on the intermediate files, returns its result if it changed anything"""
+
+    # Watch the output files to detect changes
+    with ResultWatcher(
+        prog_name, temp_files, config_dir=Path(Gimp.directory())
+    ) as watcher:
+        call_program(prog_name, prog_filepath, temp_files, timeout, trace, watcher)
+        # e.g. waiting for the hdr output to be completely written
+        with trace.stage("collect"):
+            return watcher.collect()
+
+
+def run_step_each(
+    prog_name: str,
+    prog_filepath: Path,
+    temp_files: List[str],
+    timeout: int,
+    trace: Trace,
+) -> List[Optional[str]]:
+    """Run one program on several files at once, returns per file its result or None"""
+
+    with ResultWatcher(
+        prog_name, temp_files, each=True, config_dir=Path(Gimp.directory())
+    ) as watcher:
+        call_program(prog_name, prog_filepath, temp_files, timeout, trace, watcher)
+        with trace.stage("collect"):
+            return watcher.collect_each()
+
+
+def call_program(
+    prog_name: str,
+    prog_filepath: Path,
+    temp_files: List[str],
+    timeout: int,
+    trace: Trace,
+    watcher: ResultWatcher,
+) -> None:
+    """Launch the program on the files and wait until it exits, launch included"""
+
+    Gimp.progress_init(f"Calling {prog_name}...")
+    before = child_usage()
+    with trace.stage("program", child=True):
+        elapsed = run_program(
+            build_command(prog_filepath, temp_files),
+            timeout,
+            pulse_progress(prog_name),
+            watcher,
+            get_program_env(prog_filepath),
+        )
+    Gimp.progress_set_text(
+        f"{prog_name} finished after {elapsed:.1f}s{usage_note(before)}"
+    )
 
-    try:
-        # Save all temporary images to disk
-        for i, img in enumerate(images):
-            temp_path = os.path.join(tempfile.gettempdir(), f"tmpNik_{i}.jpg")
-            temp_files.append(temp_path)
-
-            Gimp.progress_init(f"Saving image {i+1}/{len(images)}")
-            Gimp.file_save(
-                run_mode=Gimp.RunMode.NONINTERACTIVE,
-                image=img,
-                file=Gio.File.new_for_path(temp_path),
-                options=None,
+
+def run_each_layer(
+    prog_idxs: List[int],
+    layers: List[Gimp.Layer],
+    settings: ExportSettings,
+    timeout: int,
+    trace: Trace,
+    roi: Optional[Rect] = None,
+    mask: Optional[Gimp.Channel] = None,
+) -> Tuple[int, Optional[str]]:
+    """
+    Run the program on each layer and apply each result to its own layer
+    Programs accepting multiple files get all of them in one launch, others one launch
+    per layer with the wineserver kept warm in between
+    Returns:
+        Number of changed layers
+        Why the run stopped early, None if all layers were run
+    Raises:
+        Cancelled, OSError, subprocess.SubprocessError before any layer is done,
+        a later launch stops the run and keeps the layers done
+    """
+
+    import subprocess
+
+    prog_name, prog_filepath = list_progs(prog_idxs[0])
+    if len(prog_idxs) > 1 or is_hdr_prog(prog_name):
+        raise ValueError(
+            "Selected layers are processed one by one, "
+            "chains and HDR Efex need another layer source"
+        )
+    settings, run_workspace = admit_run(
+        layer_sizes(layers, roi), settings, prog_name, trace
+    )
+    trace.set(format=settings.fmt.value)
+    warm_wine(prog_filepath)
+    with run_workspace as workspace:
+        with trace.stage("export"):
+            temp_files = export_images(layers, settings, workspace, roi=roi)
+
+        stopped = None
+        if nikcore.accepts_multiple_files(prog_name):
+            trace.set(launches=1)
+            results = run_step_each(
+                prog_name, prog_filepath, temp_files, timeout, trace
             )
+        else:
+            results = []
+            for temp_file in temp_files:
+                try:
+                    results.append(
+                        run_step(prog_name, prog_filepath, [temp_file], timeout, trace)
+                    )
+                except (Cancelled, OSError, subprocess.SubprocessError) as error:
+                    if not any(results):
+                        raise
+                    stopped = f"Stopped at layer {len(results) + 1}: {error}"
+                    break
+            trace.set(launches=len(results))
+
+        with trace.stage("import"):
+            for layer, result in zip(layers, results):
+                if result:
+                    size = (layer.get_width(), layer.get_height())
+                    import_region(layer, size, result, roi, mask)
+
+    return sum(1 for result in results if result), stopped
+
+
+def parse_chain(text: str) -> List[int]:
+    """Program indices of a chain given as indices or names, separated by ',' or '>'"""
+
+    progs = nikcore.discover_progs(Path(Gimp.directory()))
+    items = [item for item in text.replace(">", ",").split(",") if item.strip()]
+    if not items:
+        raise ValueError(
+            "No programs given for the chain, e.g. 'Dfine, Viveza, Sharpener'"
+        )
+    prog_idxs = [nikcore.find_prog(item, progs) for item in items]
+    if any(is_hdr_prog(progs[idx][0]) for idx in prog_idxs[1:]):
+        raise ValueError(
+            "HDR Efex Pro merges several images, it can only be the first step"
+        )
+    return prog_idxs
+
+
+def run_chain(
+    prog_idxs: List[int],
+    layers: List[Gimp.Layer],
+    settings: ExportSettings,
+    workspace: Path,
+    timeout: int = 0,
+    trace: Optional[Trace] = None,
+    roi: Optional[Rect] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Run the programs one after another on the same intermediate file, exported once
+    The intermediate format is the one of the first program (see ExportSettings.resolve())
+    The chain stops at the first step that changes nothing or fails,
+    each step's result is kept aside as the next one rewrites the file
+    Returns:
+        Result of the last completed step, None if there is none
+        Why the chain stopped early, None if all steps were applied
+    Raises:
+        Cancelled, the result so far is dropped
+    """
+
+    import shutil
+    import subprocess
+
+    trace = trace or Trace(None)
+    progs = [list_progs(idx) for idx in prog_idxs]
+    settings = settings.resolve(progs[0][0])
+    trace.set(format=settings.fmt.value)
+    warm_wine(progs[0][1])
+    with trace.stage("export"):
+        temp_files = export_images(layers, settings, workspace, roi=roi)
+
+    result = None
+    for step, (prog_name, prog_filepath) in enumerate(progs, 1):
+        if result is not None:
+            # a failing step or a terminated one may leave the file half written
+            kept = workspace / f"step{step - 1}{Path(result).suffix}"
+            shutil.copyfile(result, kept)
+            result = str(kept)
+        try:
+            step_result = run_step(prog_name, prog_filepath, temp_files, timeout, trace)
+        except (OSError, subprocess.SubprocessError) as error:
+            return result, f"Chain stopped, step {step} {prog_name} failed: {error}"
+        if step_result is None:
+            return result, f"Chain stopped, step {step} {prog_name} made no changes"
+        # hdr output was moved onto the first file, the next steps work on it alone
+        result, temp_files = step_result, [step_result]
+    return result, None
+
+
+def run_main_dialog(
+    procedure: Gimp.Procedure, config: Gimp.ProcedureConfig, image: Gimp.Image
+) -> Tuple[bool, Optional[Workspace]]:
+    """Dialog of plugin_main(), for the main procedure its likely input is exported meanwhile
+    Returns:
+        False if cancelled
+        The workspace holding the input if exported for the confirmed choices, else None
+    """
 
-        # Track modification time of first file to detect changes
-        time_before = os.path.getmtime(temp_files[0])
-
-        # Run the external program
-        if sys.platform == "darwin":
-            prog_caller = ["open", "-W", "-a"]
-        elif sys.platform == "linux":
-            prog_caller = ["wine"]
-        else:  # windows
-            prog_caller = []
-        cmd = prog_caller + [str(prog_filepath)] + temp_files
-        Gimp.progress_init(f"Calling {prog_name}...")
-        Gimp.progress_pulse()
-        subprocess.check_call(cmd)
-
-        # location of the processed image
-        result_path = temp_files[0]
-
-        # handle troublesome hdr program
-        # it cannot save image correctly, so find & move its output to the designed location
-        hdr_path = find_hdr_output(prog_name, Path(temp_files[0]))
-        if is_hdr and hdr_path:
-            shutil.move(hdr_path, result_path)
-
-        # Check if the file was modified
-        time_after = os.path.getmtime(result_path)
-        return None if time_before == time_after else result_path
+    speculation = None
+    if base_name(procedure) == PROC_NAME:
+        speculation = SpeculativeExport.start(image, config)
+    confirmed = run_dialog(procedure, config)
+    if speculation is None:
+        return confirmed, None
+    if not confirmed:
+        speculation.discard()
+        return False, None
+    try:
+        return True, speculation.take(export_key(image, config))
+    except Exception:
+        speculation.discard()
+        raise
 
-    finally:
-        # Clean up temporary files except the first one (potential result)
-        for i, temp_file in enumerate(temp_files):
-            try:
-                # Don't delete first file yet since it might be the result
-                if i > 0 and os.path.exists(temp_file):
-                    os.remove(temp_file)
-            except Exception:
-                pass  # Ignore errors in cleanup
+
+def get_export_settings(config: Gimp.ProcedureConfig) -> ExportSettings:
+    return ExportSettings(
+        fmt=FileFormat(config.get_property("format")),
+        png_level=int(config.get_property("png-level")),
+        jpeg_quality=int(config.get_property("jpeg-quality")),
+    )
+
+
+def get_prog_idxs(config: Gimp.ProcedureConfig, is_chain: bool) -> List[int]:
+    """Programs to run in order, a chain has several"""
+
+    if is_chain:
+        return parse_chain(str(config.get_property("programs")))
+    return [int(config.get_property("command"))]
+
+
+def import_region(
+    target_layer: Gimp.Layer,
+    source_size: Tuple[int, int],
+    tmp_filepath: str,
+    roi: Optional[Rect],
+    mask: Optional[Gimp.Channel],
+) -> Optional[Tuple[int, int]]:
+    """Import the result into the whole target layer or only into the region of it
+    Returns the tile stats of process_result()
+    """
+
+    region = None
+    if roi:
+        region = layer_rect(target_layer, roi)
+        limit_merge(target_layer.get_image(), target_layer, region, mask)
+    return process_result(target_layer, source_size, tmp_filepath, region)
+
+
+def save_selection(image: Gimp.Image) -> Optional[Gimp.Channel]:
+    """The selection as a channel, None if nothing is selected
+    The saved channel becomes the selected drawable, the layers are selected again
+    """
+
+    if Gimp.Selection.is_empty(image):
+        return None
+    layers = image.get_selected_layers()
+    channel = Gimp.Selection.save(image)
+    if layers:
+        image.set_selected_layers(layers)
+    return channel
+
+
+def restore_selection(image: Gimp.Image, channel: Optional[Gimp.Channel]) -> None:
+    """Select the saved channel again and remove it, keeping the selected layers"""
+
+    if channel is not None:
+        layers = image.get_selected_layers()
+        image.select_item(Gimp.ChannelOps.REPLACE, channel)
+        image.remove_channel(channel)
+        if layers:
+            image.set_selected_layers(layers)
+
+
+def each_layer_main(
+    procedure: Gimp.Procedure,
+    prog_idxs: List[int],
+    layers: List[Gimp.Layer],
+    settings: ExportSettings,
+    timeout: int,
+    trace: Trace,
+    roi: Optional[Rect],
+    mask: Optional[Gimp.Channel],
+) -> Gimp.ValueArray:
+    """The main procedure's run on the selected layers, see run_each_layer()"""
+
+    try:
+        changed, stopped = run_each_layer(
+            prog_idxs, layers, settings, timeout, trace, roi, mask
+        )
+    except Cancelled as error:
+        trace.save("cancelled")
+        return procedure.new_return_values(
+            Gimp.PDBStatusType.CANCEL, GLib.Error(message=str(error))
+        )
+    trace.save("partial" if stopped else "ok" if changed else "unchanged")
+    if stopped:
+        # the layers before are applied, tell why the rest wasn't
+        Gimp.message(stopped)
+    message = f"{changed} of {len(layers)} layers changed"
+    return procedure.new_return_values(
+        Gimp.PDBStatusType.SUCCESS, GLib.Error(message=message)
+    )
 
 
 def plugin_main(
     procedure: Gimp.Procedure,
     run_mode: Gimp.RunMode,
     image: Gimp.Image,
-    drawables: List[Gimp.Drawable],  # pylint: disable=W0613
+    drawables: List[Gimp.Drawable],
     config: Gimp.ProcedureConfig,
     run_data: Any,  # pylint: disable=W0613
 ) -> Gimp.ValueArray:
     """Main function executed by the plugin"""
 
+    forwarded = forward_to_resident(procedure, run_mode, image, drawables, config)
+    if forwarded is not None:
+        return forwarded
+    is_resident = procedure.get_proc_type() == Gimp.PDBProcType.TEMPORARY
+    # interpreter and library startup of this process before the run
+    startup = None if is_resident else nikcore.process_age()
+
+    trace = Trace(None)
+    saved_selection: Optional[Gimp.Channel] = None
+    exported: Optional[Workspace] = None
     try:
         # Open dialog to get config parameters
-        if run_mode == Gimp.RunMode.INTERACTIVE:
-            GimpUi.init(PROC_NAME)
-            Gegl.init(None)
-            dialog = GimpUi.ProcedureDialog(procedure=procedure, config=config)
-            dialog.fill(None)
-            if not dialog.run():
-                dialog.destroy()
-                return procedure.new_return_values(
-                    Gimp.PDBStatusType.CANCEL,
-                    GLib.Error(message="No dialog response"),
-                )
-            dialog.destroy()
+        confirmed, exported = (
+            run_main_dialog(procedure, config, image)
+            if run_mode == Gimp.RunMode.INTERACTIVE
+            else (True, None)
+        )
+        if not confirmed:
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.CANCEL,
+                GLib.Error(message="No dialog response"),
+            )
 
         # Get parameters
         visible = str(config.get_property("visible"))
-        prog_idx = int(config.get_property("command"))
-        prog_name: str = list_progs(prog_idx)[0]
-        is_hdr: bool = "hdr efex pro" in prog_name.lower()
+        is_chain = base_name(procedure) == CHAIN_PROC_NAME
+        prog_idxs = get_prog_idxs(config, is_chain)
+        settings = get_export_settings(config)
+        timeout = int(config.get_property("timeout"))
+        reuse_cached = not is_chain and bool(config.get_property("reuse-cached"))
+        region_mode = RegionMode(config.get_property("region"))
+        margin = int(config.get_property("margin"))
+        prog_name: str = list_progs(prog_idxs[0])[0]
+        is_hdr: bool = is_hdr_prog(prog_name)
+        trace = Trace(
+            nikcore.get_trace_path(Path(Gimp.directory())),
+            prog=" > ".join(list_progs(idx)[0] for idx in prog_idxs),
+            width=image.get_width(),
+            height=image.get_height(),
+            resident=is_resident,
+            exported_ahead=exported is not None,
+        )
+        trace.add("startup", startup)
 
         # Start an undo_group
         Gimp.context_push()
         image.undo_group_start()
 
-        # Prepare layers and create temporary images
-        target_layer, tmp_images = prepare_data(
-            image,
-            visible,
-            prog_name,
-            is_hdr,
+        roi = get_roi(image, margin) if region_mode != RegionMode.WHOLE else None
+        # checked before preparing, a refused run leaves the image as it was
+        # an input exported ahead has passed the check, see SpeculativeExport.start()
+        settings, run_workspace = (
+            (settings, exported)
+            if exported or visible == LayerSource.SELECTED_LAYERS
+            else admit_run(
+                input_sizes(image, visible, is_hdr, roi), settings, prog_name, trace
+            )
         )
 
-        # Execute external program
-        tmp_filepath = run_nik(prog_idx, tmp_images)
-
-        # If no changes detected, clean up and return
-        if tmp_filepath is None:
-            cleanup(None, tmp_images)
-
-            # Remove the target layer if it was newly created and not modified
-            if visible == LayerSource.FROM_VISIBLES:
-                image.remove_layer(target_layer)
-
-            return procedure.new_return_values(
-                Gimp.PDBStatusType.SUCCESS,
-                GLib.Error(message="No changes detected"),
+        # Prepare target layer and determine the source layers
+        with trace.stage("prepare"):
+            # the user's selection is restored when done
+            saved_selection = save_selection(image)
+            target_layer, source_layers = prepare_data(
+                image,
+                visible,
+                prog_name,
+                is_hdr,
+                roi,
+            )
+        trace.set(layers=len(source_layers), roi=roi)
+        mask = saved_selection if region_mode == RegionMode.MASKED else None
+
+        if visible == LayerSource.SELECTED_LAYERS:
+            return each_layer_main(
+                procedure,
+                prog_idxs,
+                source_layers,
+                settings,
+                timeout,
+                trace,
+                roi,
+                mask,
             )
 
-        # load the nik result from file into gimp
-        process_result(target_layer, tmp_images[0], tmp_filepath)
-        cleanup(tmp_filepath, tmp_images)
-        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+        with run_workspace as workspace:
+            # Execute external program
+            status, message = Gimp.PDBStatusType.SUCCESS, "No changes detected"
+            stopped = None
+            try:
+                if is_chain:
+                    tmp_filepath, stopped = run_chain(
+                        prog_idxs,
+                        source_layers,
+                        settings,
+                        workspace,
+                        timeout,
+                        trace,
+                        roi,
+                    )
+                    message = stopped or message
+                else:
+                    tmp_filepath = run_nik(
+                        prog_idxs[0],
+                        source_layers,
+                        settings,
+                        workspace,
+                        timeout,
+                        trace,
+                        reuse_cached,
+                        roi,
+                        exported is not None,
+                    )
+            except Cancelled as error:
+                tmp_filepath = None
+                status, message = Gimp.PDBStatusType.CANCEL, str(error)
+
+            # If no changes detected, clean up and return
+            if tmp_filepath is None:
+                # Remove the target layer if it was newly created and not modified
+                if visible == LayerSource.FROM_VISIBLES:
+                    image.remove_layer(target_layer)
+
+                trace.save(
+                    "cancelled" if status == Gimp.PDBStatusType.CANCEL else "unchanged"
+                )
+                return procedure.new_return_values(
+                    status,
+                    GLib.Error(message=message),
+                )
+
+            # load the nik result from file into gimp
+            source_size = (source_layers[0].get_width(), source_layers[0].get_height())
+            with trace.stage("import"):
+                tiles = import_region(
+                    target_layer, source_size, tmp_filepath, roi, mask
+                )
+            trace.set(tiles=tiles)
+            trace.save("ok" if not stopped else "partial")
+            if stopped:
+                # the steps before are applied, tell why the rest wasn't
+                Gimp.message(stopped)
+            return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
 
     except Exception as error:
-        show_alert(text=str(error), message=traceback.format_exc())
-        return procedure.new_return_values(
-            Gimp.PDBStatusType.EXECUTION_ERROR,
-            GLib.Error(message=f"{str(error)}\n\n{traceback.format_exc()}"),
-        )
+        trace.save(f"error: {error}")
+        return report_error(procedure, error)
     finally:
+        if exported is not None:
+            # e.g. failed before the run, removed already otherwise
+            exported.__exit__(None, None, None)
+        restore_selection(image, saved_selection)
         image.undo_group_end()
         Gimp.context_pop()
         Gimp.displays_flush()
 
 
+@dataclass
+class BatchJob:  # pylint: disable=R0902
+    """One image of a batch run and its state along the pipeline"""
+
+    name: str
+    image: Optional[Gimp.Image] = None
+    # set for images loaded from a folder
+    source: Optional[Path] = None
+    output: Optional[Path] = None
+    target_layer: Optional[Gimp.Layer] = None
+    sources: List[Gimp.Layer] = field(default_factory=list)
+    files: List[str] = field(default_factory=list)
+    watcher: Optional[ResultWatcher] = None
+    process: Optional["subprocess.Popen"] = None
+    elapsed: float = 0.0
+    result: Optional[str] = None
+    status: str = "pending"
+
+
+def collect_batch_jobs(config: Gimp.ProcedureConfig) -> List[BatchJob]:
+    """Jobs for the open images or the image files of a folder"""
+
+    if str(config.get_property("source")) == BatchSource.FOLDER:
+        if not (folder := config.get_property("folder")) or not folder.get_path():
+            raise RuntimeError("No input folder selected")
+        folder_path = Path(folder.get_path())
+        output_path = folder_path / BATCH_OUTPUT_FOLDER
+        return [
+            BatchJob(name=path.name, source=path, output=output_path / path.name)
+            for path in sorted(folder_path.iterdir())
+            if path.is_file() and path.suffix.lower() in BATCH_EXTENSIONS
+        ]
+
+    images = config.get_core_object_array("images") or Gimp.get_images()
+    return [BatchJob(name=img.get_name(), image=img) for img in images]
+
+
+def batch_export(
+    job: BatchJob,
+    prog_name: str,
+    settings: ExportSettings,
+    workspace: Path,
+    stem: str,
+) -> None:
+    """Load (if needed), prepare and save the intermediate file of a job"""
+
+    if job.source and job.image is None:
+        job.image = Gimp.file_load(
+            Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(str(job.source))
+        )
+    job.image.undo_group_start()
+    job.target_layer, job.sources = prepare_data(
+        job.image, LayerSource.FROM_VISIBLES, prog_name, False
+    )
+    # refused jobs fail on their own, see plan_export()
+    settings, _ = nikcore.plan_export(layer_sizes(job.sources), settings)
+    job.files = export_images(job.sources, settings, workspace, stem)
+
+
+def batch_finish(job: BatchJob) -> None:
+    """Integrate the result of a job and release its resources"""
+
+    try:
+        if job.result:
+            source = job.sources[0]
+            source_size = (source.get_width(), source.get_height())
+            process_result(job.target_layer, source_size, job.result)
+            if job.output:
+                job.output.parent.mkdir(exist_ok=True)
+                Gimp.file_save(
+                    Gimp.RunMode.NONINTERACTIVE,
+                    job.image,
+                    Gio.File.new_for_path(str(job.output)),
+                    None,
+                )
+            job.status = f"done ({job.elapsed:.1f}s)"
+        elif job.target_layer:
+            job.image.remove_layer(job.target_layer)
+            job.status = job.status if job.status != "pending" else "no changes"
+    except Exception as error:
+        job.status = f"failed: {error}"
+    finally:
+        job.sources = []
+        # the jobs in flight stay within the workspace's estimate, see batch_workspace()
+        for path in {*job.files, *filter(None, [job.result])}:
+            nikcore.remove_file(Path(path))
+        job.files = []
+        if job.image:
+            job.image.undo_group_end()
+            if job.source:
+                job.image.delete()
+
+
+def batch_workspace(jobs: List[BatchJob]) -> Workspace:
+    """
+    Workspace for the jobs in flight: the previous one importing, one in the program
+    and the next one exported, each with its input and result
+    Folder jobs are taken to be as large as the first one, which is loaded for it
+    """
+
+    if jobs and jobs[0].source:
+        try:
+            jobs[0].image = Gimp.file_load(
+                Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(str(jobs[0].source))
+            )
+        except Exception:
+            # batch_export() tries again and reports the failure
+            pass
+    # pixels of the new layer from the visibles: with alpha, 8 or 16 bit
+    sizes = [
+        job.image.get_width()
+        * job.image.get_height()
+        * (4 if job.image.get_precision() in U8_PRECISIONS else 8)
+        for job in jobs
+        if job.image
+    ]
+    return Workspace(3 * 2 * max(sizes, default=0))
+
+
+def run_batch(
+    jobs: List[BatchJob],
+    prog_idx: int,
+    settings: ExportSettings,
+    workspace: Path,
+    timeout: int = 0,
+) -> None:
+    """Run the program over all jobs
+    While Nik works on image N, image N+1 is exported and the result of N-1 imported,
+    so GIMP side I/O overlaps with the time spent in the external program
+    """
+
+    prog_name, prog_filepath = list_progs(prog_idx)
+    settings = settings.resolve(prog_name)
+    env = get_program_env(prog_filepath)
+    warm_wine(prog_filepath)
+
+    def export(idx: int) -> None:
+        if idx < len(jobs):
+            try:
+                batch_export(jobs[idx], prog_name, settings, workspace, f"tmpNik{idx}")
+            except Exception as error:
+                jobs[idx].status = f"failed: {error}"
+
+    export(0)
+    for idx, job in enumerate(jobs):
+        Gimp.progress_init(f"{prog_name}: {idx+1}/{len(jobs)} {job.name}")
+        if job.status == "pending":
+            try:
+                job.watcher = ResultWatcher(
+                    prog_name, job.files, config_dir=Path(Gimp.directory())
+                )
+                job.process = launch(build_command(prog_filepath, job.files), env)
+            except Exception as error:
+                # finished like any other failed job, the next ones still run
+                job.status = f"failed: {error}"
+                if job.watcher:
+                    job.watcher.close()
+        # overlap: next export & previous import while the program is running
+        export(idx + 1)
+        if idx > 0:
+            batch_finish(jobs[idx - 1])
+        if not job.process:
+            continue
+        try:
+            job.elapsed = wait_program(
+                job.process, timeout, pulse_progress(prog_name), job.watcher
+            )
+            job.result = job.watcher.collect()
+        except Cancelled:
+            # stop here, drop the prepared next job and skip the remaining ones
+            for rest in jobs[idx:]:
+                rest.status = "cancelled"
+            for rest in jobs[idx : idx + 2]:
+                batch_finish(rest)
+            return
+        except Exception as error:
+            job.status = f"failed: {error}"
+        finally:
+            terminate(job.process)
+            job.watcher.close()
+    if jobs:
+        batch_finish(jobs[-1])
+
+
+def batch_main(
+    procedure: Gimp.Procedure,
+    run_mode: Gimp.RunMode,
+    image: Gimp.Image,
+    drawables: List[Gimp.Drawable],
+    config: Gimp.ProcedureConfig,
+    run_data: Any,  # pylint: disable=W0613
+) -> Gimp.ValueArray:
+    """Batch procedure: one Nik program over several images"""
+
+    forwarded = forward_to_resident(procedure, run_mode, image, drawables, config)
+    if forwarded is not None:
+        return forwarded
+    try:
+        properties = [
+            "source",
+            "folder",
+            "command",
+            "format",
+            "png-level",
+            "jpeg-quality",
+            "timeout",
+        ]
+        if run_mode == Gimp.RunMode.INTERACTIVE and not run_dialog(
+            procedure, config, properties
+        ):
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.CANCEL,
+                GLib.Error(message="No dialog response"),
+            )
+
+        prog_idx = int(config.get_property("command"))
+        settings = get_export_settings(config)
+        timeout = int(config.get_property("timeout"))
+        jobs = collect_batch_jobs(config)
+
+        Gimp.context_push()
+        try:
+            with batch_workspace(jobs) as workspace:
+                run_batch(jobs, prog_idx, settings, workspace, timeout)
+        finally:
+            Gimp.context_pop()
+            Gimp.displays_flush()
+
+        summary = "\n".join(f"{job.name}: {job.status}" for job in jobs)
+        if run_mode == Gimp.RunMode.INTERACTIVE:
+            Gimp.message(f"{BATCH_PROC_NAME}: {len(jobs)} image(s)\n{summary}")
+        return_vals = procedure.new_return_values(
+            Gimp.PDBStatusType.SUCCESS, GLib.Error()
+        )
+        return_vals.remove(1)
+        return_vals.insert(1, GObject.Value(GObject.TYPE_STRING, summary))
+        return return_vals
+
+    except Exception as error:
+        return report_error(procedure, error)
+
+
+# Time of the resident's last finished run, see resident_main()
+_LAST_RUN: float = 0.0
+
+
+def serve(run_func: Callable[..., Gimp.ValueArray]) -> Callable[..., Gimp.ValueArray]:
+    """Run function of a temporary procedure, its runs keep the resident alive"""
+
+    def run(*args: Any) -> Gimp.ValueArray:
+        global _LAST_RUN  # pylint: disable=W0603
+        try:
+            return run_func(*args)
+        finally:
+            _LAST_RUN = time.monotonic()
+
+    return run
+
+
+def resident_main(
+    procedure: Gimp.Procedure,
+    config: Gimp.ProcedureConfig,  # pylint: disable=W0613
+    run_data: Any,  # pylint: disable=W0613
+) -> Gimp.ValueArray:
+    """
+    Resident process, started along with GIMP or by the first run: registers the temporary
+    procedures and serves their runs one after another, as queued by GIMP,
+    until none came for RESIDENT_IDLE_SECONDS
+    Discovery, the GEGL/GTK libraries and the dialog setup stay loaded in between
+    """
+
+    global _LAST_RUN  # pylint: disable=W0603
+    from gi.repository import Gegl, GimpUi
+
+    plugin = procedure.get_plug_in()
+    for name in (PROC_NAME, CHAIN_PROC_NAME, BATCH_PROC_NAME):
+        plugin.add_temp_procedure(plugin.build_procedure(name, temporary=True))
+    GimpUi.init(RESIDENT_PROC_NAME)
+    Gegl.init(None)
+    plugin.persistent_enable()
+
+    idle = nikcore.RESIDENT_IDLE_SECONDS
+    _LAST_RUN = time.monotonic()
+    while idle <= 0 or time.monotonic() - _LAST_RUN < idle:
+        # serves one request or returns after the timeout (ms), 0 waits without one
+        plugin.persistent_process(1000 if idle > 0 else 0)
+    return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+
+
 class LayerSource(str, Enum):
     FROM_VISIBLES = "new_from_visibles"
     CURRENT_LAYER = "use_current_layer"
+    SELECTED_LAYERS = "use_selected_layers"
 
     @classmethod
     def create_choice(cls) -> Gimp.Choice:
@@ -512,28 +1793,183 @@ class LayerSource(str, Enum):
             label="use current layer",
             help="Apply filter directly on the active layer",
         )
+        choice.add(
+            nick=cls.SELECTED_LAYERS,
+            id=2,
+            label="use selected layers",
+            help="Apply filter directly on each selected layer, "
+            "in one launch if the program supports it (MULTI_FILE_PROGS)",
+        )
+        return choice
+
+
+class RegionMode(str, Enum):
+    WHOLE = "whole"
+    SELECTION = "selection"
+    MASKED = "masked"
+
+    @classmethod
+    def create_choice(cls) -> Gimp.Choice:
+        choice = Gimp.Choice.new()
+        choice.add(
+            nick=cls.WHOLE,
+            id=0,
+            label="whole layer",
+            help="Hand over the whole layer, the selection is ignored",
+        )
+        choice.add(
+            nick=cls.SELECTION,
+            id=1,
+            label="selection bounds",
+            help="Hand over only the selection's bounding box plus margin",
+        )
+        choice.add(
+            nick=cls.MASKED,
+            id=2,
+            label="selection, masked",
+            help="As selection bounds, the result is applied through the selection",
+        )
         return choice
 
 
+class BatchSource(str, Enum):
+    OPEN_IMAGES = "open_images"
+    FOLDER = "folder"
+
+    @classmethod
+    def create_choice(cls) -> Gimp.Choice:
+        choice = Gimp.Choice.new()
+        choice.add(
+            nick=cls.OPEN_IMAGES,
+            id=0,
+            label="open images",
+            help="Apply filter on a new layer from the visibles of each open image",
+        )
+        choice.add(
+            nick=cls.FOLDER,
+            id=1,
+            label="folder",
+            help=f"Apply filter on the image files of a folder into '{BATCH_OUTPUT_FOLDER}/'",
+        )
+        return choice
+
+
+def create_format_choice() -> Gimp.Choice:
+    choice = Gimp.Choice.new()
+    for idx, fmt in enumerate(FileFormat):
+        choice.add(nick=fmt, id=idx, label=fmt.label, help=fmt.help)
+    return choice
+
+
+def add_program_arguments(procedure: Gimp.Procedure, with_command: bool = True) -> None:
+    """Arguments shared by all procedures: program and intermediate format"""
+
+    # Dropdown selection list of programs
+    if with_command:
+        command_choice = Gimp.Choice.new()
+        programs = list_progs()
+        for idx, prog in enumerate(programs):
+            # the get_property(choice_name) returns 'nick' not 'id' so str(id) to get idx later
+            command_choice.add(str(idx), idx, prog, prog)
+        procedure.add_choice_argument(
+            "command",
+            "Program:",
+            "Select external program to run",
+            command_choice,
+            "0",
+            GObject.ParamFlags.READWRITE,
+        )
+
+    # Intermediate file format handed over to the program
+    procedure.add_choice_argument(
+        name="format",
+        nick="Format:",
+        blurb="Intermediate file format",
+        choice=create_format_choice(),
+        value=FileFormat.AUTO,
+        flags=GObject.ParamFlags.READWRITE,
+    )
+    procedure.add_int_argument(
+        "png-level",
+        "PNG level:",
+        "Compression level for PNG (0: none, 9: smallest)",
+        0,
+        9,
+        1,
+        GObject.ParamFlags.READWRITE,
+    )
+    procedure.add_int_argument(
+        "jpeg-quality",
+        "JPEG quality:",
+        "Quality for JPEG (1: smallest, 100: best)",
+        1,
+        100,
+        95,
+        GObject.ParamFlags.READWRITE,
+    )
+    procedure.add_int_argument(
+        "timeout",
+        "Timeout (s):",
+        "Stop the program if it's still running after this time (0: never)",
+        0,
+        24 * 3600,
+        nikcore.NIK_TIMEOUT,
+        GObject.ParamFlags.READWRITE,
+    )
+
+
 class NikPlugin(Gimp.PlugIn):
 
     def do_query_procedures(self):
-        return [PROC_NAME]
+        names = [PROC_NAME, CHAIN_PROC_NAME, BATCH_PROC_NAME]
+        if nikcore.RESIDENT_MODE:
+            # without arguments, GIMP starts it along with itself
+            names.append(RESIDENT_PROC_NAME)
+        return names
 
     def do_create_procedure(self, name):
+        if name == RESIDENT_PROC_NAME:
+            procedure = Gimp.Procedure.new(
+                self,
+                name,
+                Gimp.PDBProcType.PERSISTENT,
+                resident_main,
+                None,
+            )
+            procedure.set_documentation(RESIDENT_HELP, RESIDENT_DOC, None)
+            procedure.set_attribution(AUTHOR, COPYRIGHT, DATE)
+            return procedure
+        return self.build_procedure(name)
+
+    def build_procedure(self, name, temporary=False):
+        """
+        Procedure with its menu entry, or the resident's temporary counterpart
+        which has no menu entry and the name suffixed by RESIDENT_SUFFIX
+        The menu entries stay with the plug-in, they outlive the resident
+        """
+
+        run_func = batch_main if name == BATCH_PROC_NAME else plugin_main
         procedure = Gimp.ImageProcedure.new(
             self,
-            name,
-            Gimp.PDBProcType.PLUGIN,
-            plugin_main,
+            name + RESIDENT_SUFFIX if temporary else name,
+            Gimp.PDBProcType.TEMPORARY if temporary else Gimp.PDBProcType.PLUGIN,
+            serve(run_func) if temporary else run_func,
             None,
         )
+        procedure.set_attribution(AUTHOR, COPYRIGHT, DATE)
+        if name == BATCH_PROC_NAME:
+            self.add_batch_arguments(procedure, with_menu=not temporary)
+            return procedure
 
         procedure.set_image_types("RGB*, GRAY*")
-        procedure.set_attribution(AUTHOR, COPYRIGHT, DATE)
-        procedure.set_documentation(HELP, DOC, None)
-        procedure.set_menu_label(PROC_NAME)
-        procedure.add_menu_path("<Image>/Filters/")
+        if name == CHAIN_PROC_NAME:
+            procedure.set_documentation(CHAIN_HELP, CHAIN_DOC, None)
+            procedure.set_menu_label(f"{PROC_NAME} Chain...")
+        else:
+            procedure.set_documentation(HELP, DOC, None)
+            procedure.set_menu_label(PROC_NAME)
+        if not temporary:
+            procedure.add_menu_path("<Image>/Filters/")
 
         # Replace PF_RADIO choice
         visible_choice = LayerSource.create_choice()
@@ -546,21 +1982,88 @@ class NikPlugin(Gimp.PlugIn):
             flags=GObject.ParamFlags.READWRITE,
         )
 
-        # Dropdown selection list of programs
-        command_choice = Gimp.Choice.new()
-        programs = list_progs()
-        for idx, prog in enumerate(programs):
-            # the get_property(choice_name) returns 'nick' not 'id' so str(id) to get idx later
-            command_choice.add(str(idx), idx, prog, prog)
+        if name == CHAIN_PROC_NAME:
+            procedure.add_string_argument(
+                "programs",
+                "Programs:",
+                "Programs in order, by index or name separated by ',' "
+                "e.g. 'Dfine, Viveza, Sharpener'",
+                "",
+                GObject.ParamFlags.READWRITE,
+            )
+            add_program_arguments(procedure, with_command=False)
+        else:
+            add_program_arguments(procedure)
+            procedure.add_boolean_argument(
+                "reuse-cached",
+                "Reuse cached result",
+                "Apply the result of an earlier run on identical pixels without "
+                "launching the program (needs RESULT_CACHE_MB in nikcore.py)",
+                False,
+                GObject.ParamFlags.READWRITE,
+            )
         procedure.add_choice_argument(
-            "command",
-            "Program:",
-            "Select external program to run",
-            command_choice,
-            "0",
+            name="region",
+            nick="Region:",
+            blurb="Part of the image handed over if there is a selection",
+            choice=RegionMode.create_choice(),
+            value=RegionMode.WHOLE,
+            flags=GObject.ParamFlags.READWRITE,
+        )
+        procedure.add_int_argument(
+            "margin",
+            "Margin (px):",
+            "Context around the selection bounds handed over as well",
+            0,
+            1024,
+            32,
             GObject.ParamFlags.READWRITE,
         )
         return procedure
 
+    def add_batch_arguments(self, procedure, with_menu=True):
+        procedure.set_image_types("*")
+        procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.ALWAYS)
+        procedure.set_documentation(BATCH_HELP, BATCH_DOC, None)
+        procedure.set_menu_label(f"{PROC_NAME} Batch...")
+        if with_menu:
+            procedure.add_menu_path("<Image>/Filters/")
+
+        procedure.add_choice_argument(
+            name="source",
+            nick="Images:",
+            blurb="Select the images to process",
+            choice=BatchSource.create_choice(),
+            value=BatchSource.OPEN_IMAGES,
+            flags=GObject.ParamFlags.READWRITE,
+        )
+        procedure.add_file_argument(
+            "folder",
+            "Folder:",
+            "Folder with the image files to process",
+            Gimp.FileChooserAction.SELECT_FOLDER,
+            True,
+            None,
+            GObject.ParamFlags.READWRITE,
+        )
+        # for non-interactive calls, all open images if empty
+        procedure.add_core_object_array_argument(
+            "images",
+            "Images",
+            "Images to process (default: all open images)",
+            Gimp.Image.__gtype__,
+            GObject.ParamFlags.READWRITE,
+        )
+
+        add_program_arguments(procedure)
+        procedure.add_string_return_value(
+            "summary",
+            "Summary",
+            "Result per image, one per line",
+            "",
+            GObject.ParamFlags.READWRITE,
+        )
+
 
-Gimp.main(NikPlugin.__gtype__, sys.argv)
+if __name__ == "__main__":
+    Gimp.main(NikPlugin.__gtype__, sys.argv)